@@ -0,0 +1,120 @@
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import io
+import os
+import re
+import statistics
+import time
+import tkinter
+from css_parser import CSSParser
+from font_cache import use_fixed_metrics
+from html_parser import print_tree
+from layout import DocumentLayout, paint_tree, print_layout_tree, print_paint, tree_to_list
+from loader import fetch_and_style
+from url import URL
+
+# renders pages without opening a window: fetch -> parse -> style -> layout -> paint_tree per page
+# in a process pool, writing one dump per page
+# usage: python3 batch_render.py [-j N] [-o DIR] [--format display|layout|dom] [--list FILE] [<url or file> ...]
+
+FORMATS = {"display": "display.txt", "layout": "layout.txt", "dom": "dom.txt"}
+
+def init_worker(fixed_metrics: bool):
+    """Text is measured through Tk, which needs a display. Without one, or when asked to,
+    fall back to deterministic fixed metrics so dumps are comparable between machines"""
+    if not fixed_metrics:
+        try:
+            tkinter.Tk().withdraw()
+            return
+        except tkinter.TclError:
+            print("no display, measuring text with fixed metrics")
+    use_fixed_metrics()
+
+def to_url(arg: str) -> str:
+    if "://" not in arg and os.path.exists(arg):
+        return "file://" + os.path.abspath(arg)
+    return arg
+
+def out_name(i: int, url: str, fmt: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", url.split("://", 1)[-1]).strip("_")[:80]
+    return f"{i:04d}_{slug}.{FORMATS[fmt]}"
+
+def render(i: int, url_str: str, out_dir: str, fmt: str, width: int) -> dict:
+    """One page, runs in a worker process. Returns timings and counts instead of raising"""
+    result = {"url": url_str, "error": None, "times": {}}
+    # fetch_and_style and URL.request print progress, keep workers quiet
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            start_time = time.perf_counter()
+            default_rules = CSSParser(open("browser.css").read()).parse(origin_priority=1)
+            loaded = fetch_and_style(URL(url_str), default_rules)
+            result["times"]["fetch+style"] = time.perf_counter() - start_time
+            rootnode = loaded.rootnode
+
+            start_time = time.perf_counter()
+            document = DocumentLayout(rootnode, None)
+            document.build()
+            document.layout(width=width)
+            result["times"]["layout"] = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            display_list = []
+            paint_tree(document, display_list)
+            result["times"]["paint"] = time.perf_counter() - start_time
+
+        dump = io.StringIO()
+        with contextlib.redirect_stdout(dump):
+            if fmt == "display":
+                print_paint(display_list)
+            elif fmt == "layout":
+                print_layout_tree(document)
+            else:
+                print(print_tree(rootnode, source=True))
+        path = os.path.join(out_dir, out_name(i, url_str, fmt))
+        with open(path, "w") as file:
+            file.write(dump.getvalue())
+        result.update(path=path, nodes=sum(1 for _ in tree_to_list(rootnode)), display_list=len(display_list))
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Headless batch rendering to display list / layout / DOM dumps")
+    argparser.add_argument("urls", nargs="*", help="urls or local files")
+    argparser.add_argument("--list", help="file with one url or path per line")
+    argparser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    argparser.add_argument("-o", "--out", default="render_out", help="output directory")
+    argparser.add_argument("--format", choices=FORMATS, default="display", help="what to write per page")
+    argparser.add_argument("--width", type=int, default=1280, help="layout width")
+    argparser.add_argument("--fixed-metrics", action="store_true", help="don't use Tk to measure text, even with a display")
+    args = argparser.parse_args()
+
+    urls = list(args.urls)
+    if args.list:
+        urls += [line.strip() for line in open(args.list) if line.strip() and not line.startswith("#")]
+    if not urls:
+        argparser.error("no urls given")
+    urls = [to_url(url) for url in urls]
+    os.makedirs(args.out, exist_ok=True)
+
+    start_time = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker, initargs=(args.fixed_metrics,)) as pool:
+        futures = [pool.submit(render, i, url, args.out, args.format, args.width) for i, url in enumerate(urls)]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result["error"]:
+                print("FAILED", result["url"], result["error"])
+            else:
+                print(f"{result['path']}: {result['nodes']} nodes, {result['display_list']} display list entries")
+    elapsed = time.perf_counter() - start_time
+
+    done = [result for result in results if not result["error"]]
+    print(f"\n{len(done)}/{len(results)} pages in {elapsed:.2f}s with {args.jobs} workers, {len(done) / elapsed:.1f} pages/s")
+    for phase in ("fetch+style", "layout", "paint"):
+        times = [result["times"][phase] for result in done]
+        if times:
+            print(f"  {phase:>11}: median{statistics.median(times)*1000: 9.2f}ms  total{sum(times): 8.2f}s")
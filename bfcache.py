@@ -0,0 +1,60 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from css_parser import Rule
+from draw import SpatialIndex
+from html_parser import Element
+from layout import DocumentLayout, HitTestIndex
+from memory import page_footprint
+from url import URL
+
+BFCACHE_ENTRIES = 5 # pages kept per tab
+BFCACHE_BYTES = 64 * 1024 * 1024 # approximate memory budget per tab
+
+@dataclass
+class CachedPage:
+    url: URL # history entry this page belongs to
+    rootnode: Element
+    rules: list[Rule]
+    document: DocumentLayout
+    display_list: list
+    display_index: SpatialIndex
+    hit_index: HitTestIndex
+    text_height: float
+    title: str
+    scroll_pos: float
+    width: int # canvas width it was laid out for
+    size: int = 0 # approximate bytes, measured by put if not given
+
+class BackForwardCache:
+    """Recently left pages of one tab, keyed by their history entry (URL object identity),
+    evicted least recently used first when over the entry count or memory budget"""
+    def __init__(self, max_entries=BFCACHE_ENTRIES, max_bytes=BFCACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[URL, CachedPage] = OrderedDict()
+        self.size = 0
+
+    def put(self, page: CachedPage):
+        self.pop(page.url)
+        if not page.size:
+            page.size = page_footprint(page.rootnode, page.document, page.display_list)
+        if page.size > self.max_bytes:
+            return
+        self.entries[page.url] = page
+        self.size += page.size
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+
+    def pop(self, url: URL) -> CachedPage | None:
+        page = self.entries.pop(url, None)
+        if page:
+            self.size -= page.size
+        return page
+
+    def retain(self, urls: list[URL]):
+        """Drop pages whose history entry is gone (e.g. forward history after a new navigation)"""
+        live = set(id(url) for url in urls)
+        for url in list(self.entries):
+            if id(url) not in live:
+                self.pop(url)
@@ -1,20 +1,46 @@
+import time
 import tkinter
+from frame_metrics import FrameMetrics
 from tab import Tab
 from draw import *
 from url import URL
+import profiling
+import tracing
+
+RESIZE_DEBOUNCE_MS = 50
+FRAME_MS = 8
+TAB_MEMORY_BUDGET = 256 * 1024 * 1024 # approximate bytes for all tabs before background tabs are discarded
 
 class Browser:
     def __init__(self, options: dict={}):
         """Options:
         - rtl: bool, Right to Left text direction rendering
+        - lazy: bool, lay out long pages incrementally starting from the viewport
+        - progressive: bool, render the part of a page received so far while it loads
+        - prefetch: bool, fetch pages of tabs opened in the background before they are shown
+        - headless: bool, draw into a canvas_backend.RecordingCanvas instead of a Tk window, text is measured with fixed metrics
+        - hud: bool, show frame time, dropped frames and input latency over the page
+        - metrics: bool, print frame and input latency percentiles on exit
+        - mem: bool, print object counts and sizes of the DOM, rules, layout tree, display list etc. after each load
+        - profile: bool, write a cProfile .pstats file per page load and one for the frame loop (see profiling.py)
+        - memprofile: bool, print top allocators per load phase and growth between loads with tracemalloc
+        - trace: str, record tracing spans and write them to this file as Chrome trace-event JSON on exit
+        - tab_memory: int, bytes all tabs may use before background tabs are discarded
         - s <width>x<height>"""
         dimensions = [int(val) for val in options.get("s", "1280x720").split("x")]
         print(dimensions)
-        self.window = tkinter.Tk()
+        if options.get("headless"):
+            from canvas_backend import HeadlessWindow, RecordingCanvas
+            from font_cache import use_fixed_metrics
+            use_fixed_metrics()
+            self.window = HeadlessWindow()
+            self.canvas = RecordingCanvas(dimensions[0], dimensions[1], window=self.window)
+        else:
+            self.window = tkinter.Tk()
+            self.canvas = tkinter.Canvas(self.window,
+                                         width=dimensions[0], height=dimensions[1],
+                                         bg="white")
         self.window.configure(bg="white")
-        self.canvas = tkinter.Canvas(self.window,
-                                     width=dimensions[0], height=dimensions[1],
-                                     bg="white")
         self.canvas.pack(fill="both", expand=True)
         self.canvas.bind("<Configure>", self.resize_canvas)
         self.window.bind("<Key>", self.handle_key)
@@ -33,62 +59,152 @@ class Browser:
         # keep CLI flags accessible to other methods
         self.rtl = options.get("rtl", False) # currently broken sowwy
         self.options = options
+        if options.get("trace"):
+            tracing.enable()
+        profiling.enable(options.get("profile", False), options.get("memprofile", False))
         
-        self.drawing = False # running draw loop
+        self.damage = set() # regions to redraw next frame: "tab", "scrollbar", "chrome"
+        self.pending_frame = None # after() id of the next frame, None when idle
+        self.scrollbar_items = None # (track, thumb) canvas items
+        self.pending_resize = None # after() id of the debounced relayout
+        self.metrics = FrameMetrics()
+        self.chrome_items = {} # widget -> number of canvas items, for frame metrics
+        self.frame_items = [0, 0] # chrome items created and deleted in the current frame
         self.active_tab = None
         self.tabs = []
         
         from chrome import Chrome
         self.chrome = Chrome(self)
 
-    def new_tab(self, url: URL):
-        new_tab = Tab(url, self.canvas, self.canvas.winfo_height()-self.chrome.bottom, options=self.options)
+    def new_tab(self, url: URL, background=False):
+        """background: add the tab without switching to it, it loads when first shown"""
+        new_tab = Tab(url, self.canvas, self.canvas.winfo_height()-self.chrome.bottom, options=self.options, background=background)
         # set tab's callbacks
         new_tab._on_title_change = self.rename_window
-        new_tab._on_open_in_new_tab = self.new_tab
+        new_tab._on_open_in_new_tab = self.open_background_tab
+        new_tab._on_invalidate = self.tab_invalidated
+        new_tab._on_load = self.tab_loaded
         self.tabs.append(new_tab)
-        self.active_tab = new_tab
-        self.start()
-        self.set_tab(new_tab)
+        if background:
+            self.invalidate("chrome")
+        else:
+            self.set_tab(new_tab)
+            
+    def open_background_tab(self, url: URL):
+        self.new_tab(url, background=True)
 
-    def draw(self):
-        self.active_tab.tab_height = self.canvas.winfo_height()-self.chrome.bottom
-        self.active_tab.offset = self.chrome.bottom
+    def draw(self, damage):
+        tab = self.active_tab
+        if "tab" in damage:
+            tab.tab_height = self.canvas.winfo_height()-self.chrome.bottom
+            tab.offset = self.chrome.bottom
+            tab.draw()
+            # newly created content items are on top, keep the UI above them
+            self.canvas.tag_raise("scrollbar")
+            self.canvas.tag_raise("chrome")
+            damage.add("scrollbar")
         
-        self.active_tab.draw()
-        
-        self.canvas.delete("scrollbar")
-        self.draw_scrollbar()
+        if "scrollbar" in damage:
+            self.draw_scrollbar()
 
-        self.canvas.delete("chrome")
-        for cmd in self.chrome.paint():
-            cmd.execute(0, self.canvas, tags=('chrome'))
-        
-    def start(self):
-        if self.drawing: 
-            return
-        self.drawing = True
-        self.update()
+        if "chrome" in damage:
+            changed = self.chrome.changed_widgets()
+            for widget, cmds in changed:
+                tag = "chrome-" + widget
+                self.canvas.delete(tag)
+                for cmd in cmds:
+                    cmd.execute(0, self.canvas, tags=('chrome', tag))
+                self.frame_items[0] += len(cmds)
+                self.frame_items[1] += self.chrome_items.get(widget, 0)
+                self.chrome_items[widget] = len(cmds)
+            # the repainted background went on top, put the other widgets back above it
+            if changed and changed[0][0] == "frame":
+                from chrome import WIDGETS
+                for widget in WIDGETS[1:]:
+                    self.canvas.tag_raise("chrome-" + widget)
+    
+    def invalidate(self, *regions):
+        """Mark regions as damaged and schedule a frame if one isn't pending already"""
+        self.damage.update(regions)
+        if not self.pending_frame:
+            self.pending_frame = self.window.after(FRAME_MS, self.update)
+            
+    def tab_invalidated(self, tab):
+        if tab is self.active_tab:
+            self.invalidate("tab")
+            
+    def tab_loaded(self, tab):
+        if tab is self.active_tab:
+            self.invalidate("chrome") # redirects change the address bar
+        self.discard_background_tabs()
+    
+    def discard_background_tabs(self):
+        """Discard least recently shown background tabs until all tabs fit the memory budget"""
+        budget = self.options.get("tab_memory", TAB_MEMORY_BUDGET)
+        total = sum(tab.memory_footprint() for tab in self.tabs)
+        background = [tab for tab in self.tabs if tab is not self.active_tab and not tab.discarded]
+        for tab in sorted(background, key=lambda tab: tab.last_shown):
+            if total <= budget:
+                break
+            total -= tab.memory_footprint()
+            tab.discard()
 
     def update(self):
-        if not self.drawing:
-            return
-        self.draw()
-        self.window.after(8, self.update)
+        # nothing reschedules this unless something was invalidated, so an idle browser does no work
+        self.pending_frame = None
+        damage, self.damage = self.damage, set()
+        if self.active_tab:
+            self.metrics.frame_start()
+            profiling.frame_start()
+            with tracing.span("frame", damage=sorted(damage)):
+                self.draw(damage)
+            profiling.frame_end()
+            tab = self.active_tab
+            created, deleted = self.frame_items
+            self.metrics.frame_end(created + tab.items_created, deleted + tab.items_deleted)
+            tab.items_created = tab.items_deleted = 0
+            self.frame_items = [0, 0]
+            if self.options.get("hud"):
+                self.draw_hud()
+                
+    def draw_hud(self):
+        """Frame metrics in the top right corner, updated in place after every frame"""
+        text = self.metrics.hud_text()
+        if not self.canvas.find_withtag("hud"):
+            self.canvas.create_text(self.canvas.winfo_width() - 10, self.chrome.bottom + 10, text=text,
+                                    anchor="ne", fill="red", font=("Courier", 10), tags=('hud'))
+        else:
+            self.canvas.itemconfig("hud", text=text)
+            self.canvas.coords("hud", self.canvas.winfo_width() - 10, self.chrome.bottom + 10)
+        self.canvas.tag_raise("hud")
         
     def resize_canvas(self, e):
         self.canvas.config(width=e.width, height=e.height)
-        self.active_tab._layout()
         self.chrome.resize()
+        self.invalidate("chrome", "scrollbar")
+        # relayout once the resize settles instead of on every Configure event
+        if self.pending_resize:
+            self.window.after_cancel(self.pending_resize)
+        self.pending_resize = self.window.after(RESIZE_DEBOUNCE_MS, self.resize_layout)
+        
+    def resize_layout(self):
+        self.pending_resize = None
+        if self.active_tab:
+            self.active_tab._layout()
         
     def rename_window(self, title):
         self.window.title(title)
         
     def set_tab(self, tab: Tab):
         self.active_tab = tab
-        self.active_tab.invalidate() # request one draw frame
+        tab.last_shown = time.monotonic()
+        if tab.discarded:
+            tab.reload_discarded()
+        self.active_tab.invalidate(full=True) # request one draw frame
+        self.invalidate("chrome")
         if tab:
             self.rename_window(tab.title)
+        self.discard_background_tabs()
 
     def draw_scrollbar(self):
         if not self.active_tab:
@@ -98,28 +214,39 @@ class Browser:
         text_height = self.active_tab.text_height
         width, height = self.canvas.winfo_width(), self.canvas.winfo_height()-self.chrome.bottom
 
+        # items are created once, then moved and shown/hidden
+        if not self.scrollbar_items:
+            self.scrollbar_items = (
+                self.canvas.create_rectangle(0, 0, 0, 0, width=0, fill="#cccccc", tags=('scrollbar')),
+                self.canvas.create_rectangle(0, 0, 0, 0, width=0, fill="#aaaaaa", tags=('scrollbar')))
+        track, thumb = self.scrollbar_items
+
         # hide scrollbar if page fits in view
         if height >= text_height:
+            self.canvas.itemconfig("scrollbar", state="hidden")
             return
         
-        self.canvas.create_rectangle(
+        self.canvas.coords(track, 
             width-scroll.bar_width, self.chrome.bottom, 
-            width, height+self.chrome.bottom, width=0, fill="#cccccc", tags=('scrollbar'))
+            width, height+self.chrome.bottom)
         
         scroll.bar_height = height**2 / text_height
         scroll.bar_y = (scroll.pos * height) / text_height
-        self.canvas.create_rectangle(
+        self.canvas.coords(thumb,
             width-scroll.bar_width, self.chrome.bottom + scroll.bar_y,
-            width, self.chrome.bottom + scroll.bar_y + scroll.bar_height, width=0, fill="#aaaaaa", tags=('scrollbar'))
+            width, self.chrome.bottom + scroll.bar_y + scroll.bar_height)
+        self.canvas.itemconfig("scrollbar", state="normal")
         
     # event handlers    
     
-    def scrolldown(self, e): self.active_tab.scrolldown()
-    def scrollup(self, e): self.active_tab.scrollup()
-    def scrolldelta(self, e): self.active_tab.scrolldelta(e.delta)
-    def on_mouse_drag(self, e): self.active_tab.handle_drag_scroll(e.x, e.y - self.chrome.bottom)
+    def on_input(self, e): self.metrics.input(str(getattr(e, "type", "input"))) # KeyPress, ButtonPress, MouseWheel, ...
+    def scrolldown(self, e): self.on_input(e); self.active_tab.scrolldown()
+    def scrollup(self, e): self.on_input(e); self.active_tab.scrollup()
+    def scrolldelta(self, e): self.on_input(e); self.active_tab.scrolldelta(e.delta)
+    def on_mouse_drag(self, e): self.on_input(e); self.active_tab.handle_drag_scroll(e.x, e.y - self.chrome.bottom)
     def on_mouse_up(self, e): self.active_tab.on_mouse_up()
     def on_mouse_down(self, e): 
+        self.on_input(e)
         # check clicking on other tabs
         if e.y < self.chrome.bottom:
             self.chrome.click(e.x, e.y)
@@ -127,8 +254,11 @@ class Browser:
             # coords relative to tab
             tab_y = e.y - self.chrome.bottom
             self.active_tab.on_leftmouse_down(e.x, tab_y)
+        # focus, url or history may have changed
+        self.invalidate("chrome")
             
     def on_middlemouse_down(self, e): 
+        self.on_input(e)
         # check clicking on tabs
         if e.y < self.chrome.tabbar_bottom:
             self.chrome.middleclick(e.x, e.y)
@@ -136,14 +266,17 @@ class Browser:
             # coords relative to tab
             tab_y = e.y - self.chrome.bottom
             self.active_tab.on_middlemouse_down(e.x, tab_y)
+        self.invalidate("chrome")
 
     def handle_key(self, e):
         if len(e.char) == 0: return
         if not (0x20 <= ord(e.char) < 0x7f): return
+        self.on_input(e)
         self.chrome.keypress(e.char)
+        self.invalidate("chrome")
             
-    def handle_enter(self, e): self.chrome.enter()
-    def handle_backspace(self, e): self.chrome.backspace()
+    def handle_enter(self, e): self.on_input(e); self.chrome.enter(); self.invalidate("chrome")
+    def handle_backspace(self, e): self.on_input(e); self.chrome.backspace(); self.invalidate("chrome")
 
 if __name__ == "__main__":
     import sys
@@ -153,13 +286,31 @@ if __name__ == "__main__":
     url = ""
     for arg in sys.argv[1:]:
         if arg in ("-h", "help"):
-            print("Usage: python3 browser.py [-rtl] [-c] [-t] [-h] [<url> | test]")
+            print("Usage: python3 browser.py [-rtl] [-c] [-t] [-lazy] [-progressive] [-prefetch] [-trace] [-hud] [-metrics] [-mem] [-profile] [-memprofile] [-h] [<url> | test]")
         elif arg == "-rtl":
             options["rtl"] = True
         elif arg == "-c":
             options["c"] = True
         elif arg == "-t":
             options["t"] = True
+        elif arg == "-lazy":
+            options["lazy"] = True
+        elif arg == "-progressive":
+            options["progressive"] = True
+        elif arg == "-prefetch":
+            options["prefetch"] = True
+        elif arg == "-hud":
+            options["hud"] = True
+        elif arg == "-metrics":
+            options["metrics"] = True
+        elif arg == "-mem":
+            options["mem"] = True
+        elif arg == "-profile":
+            options["profile"] = True
+        elif arg == "-memprofile":
+            options["memprofile"] = True
+        elif arg == "-trace":
+            options["trace"] = "trace.json"
         elif arg == "test":
             url = "file:///home/yuzu/Documents/browser-dev/parsetest"
         else:
@@ -168,5 +319,10 @@ if __name__ == "__main__":
         browser = Browser(options)
         browser.new_tab(URL(url))
         tkinter.mainloop()
+        if options.get("trace"):
+            tracing.dump(options["trace"])
+        if options.get("metrics"):
+            print(browser.metrics.summary())
+        profiling.finish()
     else:
-        print("Usage: python3 browser.py [-rtl] [-c] [-t] [-h] [<url> | test]")
+        print("Usage: python3 browser.py [-rtl] [-c] [-t] [-lazy] [-progressive] [-prefetch] [-trace] [-hud] [-metrics] [-mem] [-profile] [-memprofile] [-h] [<url> | test]")
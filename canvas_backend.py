@@ -0,0 +1,196 @@
+from collections import defaultdict
+import heapq
+import itertools
+import time
+
+# headless stand-ins for the Tk window and canvas. Draw commands, Tab, Browser and Chrome only use
+# the small part of the tkinter.Canvas API implemented here, so they run unchanged against it:
+# - create_text / create_rectangle / create_line, returning item ids
+# - delete, move, coords, itemconfig, tag_raise, tag_lower, find_withtag on ids or tags
+# - winfo_width / winfo_height, config, pack, bind
+# - after / after_idle / after_cancel, run by HeadlessWindow.run_until_idle instead of a Tk mainloop
+# usage: python3 canvas_backend.py <url> [frames]  prints the recorded call stream, then times scroll frames
+
+class HeadlessWindow:
+    """Timer queue standing in for the Tk root"""
+    def __init__(self):
+        self.timers = [] # heap of (due, sequence, id)
+        self.callbacks = {} # id -> fn, cancelled timers are removed from here only
+        self.ids = itertools.count(1)
+
+    def after(self, ms, fn=None):
+        timer = next(self.ids)
+        self.callbacks[timer] = fn
+        heapq.heappush(self.timers, (time.monotonic() + ms / 1000, timer, timer))
+        return timer
+
+    def after_idle(self, fn):
+        return self.after(0, fn)
+
+    def after_cancel(self, timer):
+        self.callbacks.pop(timer, None)
+
+    def run_until_idle(self, timeout=10.0) -> int:
+        """Run timers as they come due until none are left (or timeout seconds passed), returns how many ran"""
+        ran = 0
+        deadline = time.monotonic() + timeout
+        while self.timers and time.monotonic() < deadline:
+            due, _, timer = self.timers[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(min(delay, 0.002))
+                continue
+            heapq.heappop(self.timers)
+            fn = self.callbacks.pop(timer, None)
+            if fn:
+                fn()
+                ran += 1
+        return ran
+
+    def configure(self, **options): pass
+    def bind(self, *args): pass
+    def title(self, title): self.window_title = title
+    def withdraw(self): pass
+
+class RecordingCanvas:
+    """Canvas that keeps its items in memory. With record=True every call is also logged in
+    self.calls for golden tests (see dump) and stacking order is tracked, with record=False it
+    only does the bookkeeping the browser relies on (ids, tags, coords), for timing frames without Tk"""
+    def __init__(self, width=1280, height=720, window: HeadlessWindow | None = None, record=True):
+        self.width, self.height = width, height
+        self.window = window or HeadlessWindow()
+        self.record = record
+        self.calls = [] # (method, args, options)
+        self.items = {} # id -> [kind, coords, options, tags]
+        self.tags = defaultdict(set) # tag -> ids
+        self.order = [] # ids bottom to top, recording only
+        self.ids = itertools.count(1)
+
+    def _log(self, method, args, options={}):
+        if self.record:
+            self.calls.append((method, args, options))
+
+    def _ids(self, tag_or_id) -> list[int]:
+        if isinstance(tag_or_id, int):
+            return [tag_or_id] if tag_or_id in self.items else []
+        if tag_or_id == "all":
+            return list(self.items)
+        return list(self.tags.get(tag_or_id, ()))
+
+    def _create(self, kind, coords, options):
+        options = dict(options)
+        tags = options.pop("tags", options.pop("tag", ()))
+        tags = (tags,) if isinstance(tags, str) else tuple(tags)
+        if "font" in options: # fonts compare by their font_cache key, not identity
+            options["font"] = getattr(options["font"], "id", options["font"])
+        item = next(self.ids)
+        self.items[item] = [kind, list(coords), options, tags]
+        for tag in tags:
+            self.tags[tag].add(item)
+        if self.record:
+            self.order.append(item)
+        self._log("create_" + kind, coords, dict(options, tags=tags))
+        return item
+
+    def create_text(self, *coords, **options): return self._create("text", coords, options)
+    def create_rectangle(self, *coords, **options): return self._create("rectangle", coords, options)
+    def create_line(self, *coords, **options): return self._create("line", coords, options)
+
+    def delete(self, *tags_or_ids):
+        self._log("delete", tags_or_ids)
+        for tag_or_id in tags_or_ids:
+            for item in self._ids(tag_or_id):
+                for tag in self.items.pop(item)[3]:
+                    self.tags[tag].discard(item)
+                if self.record:
+                    self.order.remove(item)
+
+    def move(self, tag_or_id, dx, dy):
+        self._log("move", (tag_or_id, dx, dy))
+        for item in self._ids(tag_or_id):
+            coords = self.items[item][1]
+            for i in range(len(coords)):
+                coords[i] += dy if i % 2 else dx
+
+    def coords(self, tag_or_id, *coords):
+        items = self._ids(tag_or_id)
+        if not coords:
+            return list(self.items[items[0]][1]) if items else []
+        self._log("coords", (tag_or_id,) + coords)
+        for item in items:
+            self.items[item][1] = list(coords)
+
+    def itemconfig(self, tag_or_id, **options):
+        self._log("itemconfig", (tag_or_id,), options)
+        for item in self._ids(tag_or_id):
+            self.items[item][2].update(options)
+
+    def _restack(self, tag_or_id, reference, above: bool):
+        if not self.record:
+            return
+        moving = set(self._ids(tag_or_id))
+        rest = [item for item in self.order if item not in moving]
+        ordered = [item for item in self.order if item in moving]
+        if reference is None:
+            self.order = rest + ordered if above else ordered + rest
+            return
+        anchors = [i for i, item in enumerate(rest) if item in set(self._ids(reference))]
+        if not anchors:
+            return
+        at = anchors[-1] + 1 if above else anchors[0]
+        self.order = rest[:at] + ordered + rest[at:]
+
+    def tag_raise(self, tag_or_id, above=None):
+        self._log("tag_raise", (tag_or_id,) if above is None else (tag_or_id, above))
+        self._restack(tag_or_id, above, above=True)
+
+    def tag_lower(self, tag_or_id, below=None):
+        self._log("tag_lower", (tag_or_id,) if below is None else (tag_or_id, below))
+        self._restack(tag_or_id, below, above=False)
+
+    def find_withtag(self, tag_or_id) -> tuple[int, ...]:
+        items = set(self._ids(tag_or_id))
+        if self.record:
+            return tuple(item for item in self.order if item in items)
+        return tuple(sorted(items))
+
+    def winfo_width(self): return self.width
+    def winfo_height(self): return self.height
+    def config(self, width=None, height=None, **options):
+        self.width = width or self.width
+        self.height = height or self.height
+    def pack(self, **options): pass
+    def bind(self, *args): pass
+    def after(self, ms, fn=None): return self.window.after(ms, fn)
+    def after_idle(self, fn): return self.window.after_idle(fn)
+    def after_cancel(self, timer): self.window.after_cancel(timer)
+
+    def dump(self) -> str:
+        """The recorded calls, one per line, for comparing against a golden file"""
+        return "\n".join(f"{method} {args} {options}" if options else f"{method} {args}"
+                         for method, args, options in self.calls)
+
+    def scene(self) -> str:
+        """Items currently on the canvas, bottom to top"""
+        return "\n".join(f"{self.items[item][0]} {self.items[item][1]} {self.items[item][2]} {self.items[item][3]}"
+                         for item in self.order)
+
+if __name__ == "__main__":
+    import sys
+    from browser import Browser
+    from url import URL
+
+    browser = Browser({"headless": True})
+    browser.new_tab(URL(sys.argv[1]))
+    browser.window.run_until_idle()
+    print(browser.canvas.dump())
+
+    # frame cost without Tk: scroll through the page one step per frame
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    browser.canvas.record = False
+    start_time = time.perf_counter()
+    for _ in range(frames):
+        browser.active_tab.scrolldown()
+        browser.update()
+    elapsed = time.perf_counter() - start_time
+    print(f"\n{frames} scroll frames in{elapsed*1000: .1f}ms, {elapsed/frames*1000: .3f}ms per frame", file=sys.stderr)
@@ -3,6 +3,9 @@ from font_cache import get_font, get_width
 from url import URL
 from browser import Browser
 
+# paint order, later widgets are stacked above earlier ones
+WIDGETS = ["frame", "tabs", "nav", "addressbar"]
+
 class Chrome:
     def __init__(self, browser: Browser):
         self.browser = browser
@@ -30,16 +33,19 @@ class Chrome:
                               self.back_rect.right+self.padding+self.NAV_WIDTH, self.urlbar_bottom-self.padding)
         self.address_rect = Rect(self.forward_rect.right+self.padding, self.urlbar_top+self.padding, 
                                  self.browser.canvas.winfo_width()-self.padding, self.urlbar_bottom-self.padding)
+        
+        self.TAB_WIDTH = self.font.measure("Tab X") + 2*self.padding
+        self.tabs_start = self.newtab_rect.right + self.padding
+        
+        self.widget_cache = {} # widget -> (state it was painted for, paint commands)
 
     def resize(self):
         self.address_rect.right = self.browser.canvas.winfo_width()-self.padding
         
     def tab_rect(self, i):
-        tabs_start = self.newtab_rect.right + self.padding
-        tab_width = self.font.measure("Tab X") + 2*self.padding
         return Rect(
-            tabs_start + tab_width*i, self.tabbar_top,
-            tabs_start + tab_width*(i+1), self.tabbar_bottom)
+            self.tabs_start + self.TAB_WIDTH*i, self.tabbar_top,
+            self.tabs_start + self.TAB_WIDTH*(i+1), self.tabbar_bottom)
         
     def click(self, x, y):
         self.focus = None
@@ -62,7 +68,7 @@ class Chrome:
         self.focus = None
         for i, tab in enumerate(self.browser.tabs):
             if self.tab_rect(i).contains_point(x, y):
-                self.browser.tabs.pop(i)
+                self.browser.tabs.pop(i).close()
                 if len(self.browser.tabs) == 0:
                     blank = URL("about:blank")
                     self.set_tab(blank)
@@ -89,7 +95,44 @@ class Chrome:
         if self.focus == "address bar":
             self.address_bar = self.address_bar[:-1]
             
+    def widget_state(self, widget):
+        """Everything a widget's paint commands depend on"""
+        width = self.browser.canvas.winfo_width()
+        tab = self.browser.active_tab
+        if widget == "frame":
+            return width
+        if widget == "tabs":
+            active = self.browser.tabs.index(tab) if tab in self.browser.tabs else -1
+            return (len(self.browser.tabs), active, width)
+        if widget == "nav":
+            return (bool(tab.can_go_back()), bool(tab.can_go_forward()))
+        if widget == "addressbar":
+            return (self.focus, self.address_bar, str(tab.url), self.address_rect.right)
+        
+    def changed_widgets(self) -> list[tuple[str, list]]:
+        """Repaint only the widgets whose state changed since they were last painted"""
+        painters = {
+            "frame": self.paint_frame,
+            "tabs": self.paint_tabs,
+            "nav": self.paint_nav,
+            "addressbar": self.paint_addressbar,
+        }
+        out = []
+        for widget in WIDGETS:
+            state = self.widget_state(widget)
+            cached = self.widget_cache.get(widget)
+            if cached and cached[0] == state:
+                continue
+            cmds = painters[widget]()
+            self.widget_cache[widget] = (state, cmds)
+            out.append((widget, cmds))
+        return out
+            
     def paint(self):
+        self.changed_widgets()
+        return [cmd for widget in WIDGETS for cmd in self.widget_cache[widget][1]]
+    
+    def paint_frame(self):
         cmds = []
         
         # white rectangle behind UI
@@ -103,10 +146,10 @@ class Chrome:
         # new tab button
         cmds.append(DrawText(self.newtab_rect.left+self.padding, self.newtab_rect.top, "+", self.PLUS_WIDTH, self.font, "black"))
         cmds.append(DrawOutline(self.newtab_rect, "black", 1))
-        
-        cmds.extend(self.paint_tabs())
-
-        # navigation buttons
+        return cmds
+    
+    def paint_nav(self):
+        cmds = []
         back_color = "black" if self.browser.active_tab.can_go_back() else "gray"
         forward_color = "black" if self.browser.active_tab.can_go_forward() else "gray"
         
@@ -114,10 +157,6 @@ class Chrome:
         cmds.append(DrawText(self.back_rect.left + self.padding, self.back_rect.top, "<", self.NAV_WIDTH, self.font, back_color))
         cmds.append(DrawOutline(self.forward_rect, forward_color, 1))
         cmds.append(DrawText(self.forward_rect.left + self.padding, self.forward_rect.top, ">", self.NAV_WIDTH, self.font, forward_color))
-        
-        cmds.extend(self.paint_addressbar())
-        cmds.append(DrawOutline(self.address_rect, "black", 1))
-                
         return cmds
     
     def paint_tabs(self):
@@ -161,4 +200,5 @@ class Chrome:
                 self.address_rect.top,
                 url, w, self.font, "black")) 
         
-        return out
\ No newline at end of file
+        out.append(DrawOutline(self.address_rect, "black", 1))
+        return out
@@ -1,3 +1,5 @@
+from bisect import bisect_left
+
 class Rect:
     def __init__(self, left, top, right, bottom):
         self.left = left
@@ -21,8 +23,13 @@ class DrawText:
         self.bottom = y1 + font.cached_metrics["linespace"]
         self.rect = Rect(x1, y1, x1+width, self.bottom)
 
+    def extend(self, text, width):
+        """Append an adjacent run of text with the same font and color"""
+        self.text += text
+        self.rect.right += width
+
     def execute(self, scroll, canvas, tags=()):
-        canvas.create_text(
+        return canvas.create_text(
             self.left, self.top - scroll,
             text=self.text,
             font=self.font,
@@ -42,7 +49,7 @@ class DrawRect:
         self.color = color
 
     def execute(self, scroll, canvas, tags=()):
-        canvas.create_rectangle(
+        return canvas.create_rectangle(
             self.rect.left, self.rect.top - scroll,
             self.rect.right, self.rect.bottom - scroll,
             width=0,
@@ -60,7 +67,7 @@ class DrawOutline:
         self.thickness = thickness
 
     def execute(self, scroll, canvas, tags=()):
-        canvas.create_rectangle(
+        return canvas.create_rectangle(
             self.rect.left, self.rect.top - scroll,
             self.rect.right, self.rect.bottom - scroll,
             width=self.thickness,
@@ -77,11 +84,58 @@ class DrawLine:
         self.thickness = thickness
 
     def execute(self, scroll, canvas, tags):
-        canvas.create_line(
+        return canvas.create_line(
             self.rect.left, self.rect.top - scroll,
             self.rect.right, self.rect.bottom - scroll,
             fill=self.color, width=self.thickness,
             tag=tags)
 
     def __repr__(self):
-        return f"DrawLine(x1={self.rect.left}, y1={self.rect.top}, x2={self.rect.right}, y2={self.rect.bottom}, color={self.color}, thickness={self.thickness})"
\ No newline at end of file
+        return f"DrawLine(x1={self.rect.left}, y1={self.rect.top}, x2={self.rect.right}, y2={self.rect.bottom}, color={self.color}, thickness={self.thickness})"
+
+class SpatialIndex:
+    """Buckets items into fixed-height bands by the y range of their rect,
+    so the items overlapping a y range are found without scanning all of them"""
+    def __init__(self, items, band_height=256, rect=lambda item: item.rect):
+        self.items = items
+        self.band_height = band_height
+        self.rect = rect
+        self.bands = []
+        for i, item in enumerate(items):
+            r = rect(item)
+            first, last = self.band(r.top), self.band(r.bottom)
+            while len(self.bands) <= last:
+                self.bands.append([])
+            for b in range(first, last+1):
+                self.bands[b].append(i)
+
+    def add(self, i):
+        """Index items[i] after it was appended to items or grew. Bands it no longer
+        overlaps keep it, queries return supersets anyway"""
+        r = self.rect(self.items[i])
+        first, last = self.band(r.top), self.band(r.bottom)
+        while len(self.bands) <= last:
+            self.bands.append([])
+        for b in range(first, last+1):
+            band = self.bands[b]
+            if not band or band[-1] < i: # appended
+                band.append(i)
+                continue
+            j = bisect_left(band, i)
+            if band[j] != i:
+                band.insert(j, i)
+
+    def band(self, y):
+        return max(0, int(y // self.band_height))
+
+    def query(self, top, bottom) -> list[int]:
+        """Indices (in insertion order) of items in bands overlapping top..bottom, a superset of the exact hits"""
+        first, last = self.band(top), min(self.band(bottom), len(self.bands)-1)
+        if first > last:
+            return []
+        if first == last:
+            return self.bands[first]
+        hits = set()
+        for b in range(first, last+1):
+            hits.update(self.bands[b])
+        return sorted(hits)
@@ -0,0 +1,209 @@
+import argparse
+import base64
+import contextlib
+from dataclasses import dataclass, field
+import gzip
+import http.client
+import io
+import json
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin, urlsplit
+from url import ACCEPT_ENCODING, URL, brotli, zstd
+
+# records real http(s) responses into a json archive and replays them from a local server,
+# optionally slowed down, so network code and benchmarks run offline and give the same results every time
+# usage: python3 fixture_server.py record <archive.json> <url> ...
+#        python3 fixture_server.py replay <archive.json> [--port N] [--latency MS] [--bandwidth KBPS] [--chunk BYTES]
+#        python3 fixture_server.py check-encodings  round-trips every advertised Content-Encoding through URL.request
+
+MAX_REDIRECTS = 10
+HOP_BY_HOP = {"connection", "keep-alive", "transfer-encoding", "content-length"} # set by the replay server itself
+
+@dataclass
+class Fixture:
+    status: int
+    headers: list[tuple[str, str]] = field(default_factory=list) # as received, body framing headers removed
+    body: bytes = b"" # as received, still content-encoded
+    url: str = ""
+
+def fetch_raw(url: str) -> Fixture:
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    connection = connection_class(parts.netloc, timeout=30)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    # same encodings the browser asks for, the stored body stays encoded
+    connection.request("GET", path, headers={"Accept-Encoding": ACCEPT_ENCODING})
+    response = connection.getresponse()
+    body = response.read() # http.client removes chunked framing but doesn't decompress
+    headers = [(name, value) for name, value in response.getheaders() if name.lower() not in HOP_BY_HOP]
+    connection.close()
+    return Fixture(response.status, headers, body, url)
+
+def record(urls: list[str]) -> list[Fixture]:
+    """Fetch urls, following redirects so their targets are in the archive too"""
+    fixtures = []
+    for url in urls:
+        for _ in range(MAX_REDIRECTS):
+            fixture = fetch_raw(url)
+            fixtures.append(fixture)
+            print(fixture.status, url, len(fixture.body), "bytes")
+            location = dict((name.lower(), value) for name, value in fixture.headers).get("location")
+            if not (300 <= fixture.status < 400 and location):
+                break
+            url = urljoin(url, location)
+    return fixtures
+
+def save(fixtures: list[Fixture], path: str):
+    entries = [{"url": fixture.url, "status": fixture.status, "headers": fixture.headers,
+                "body": base64.b64encode(fixture.body).decode("ascii")} for fixture in fixtures]
+    with open(path, "w") as file:
+        json.dump({"entries": entries}, file, indent=1)
+
+def load(path: str) -> list[Fixture]:
+    with open(path) as file:
+        entries = json.load(file)["entries"]
+    return [Fixture(entry["status"], [tuple(header) for header in entry["headers"]], base64.b64decode(entry["body"]), entry["url"])
+            for entry in entries]
+
+def by_path(fixtures: list[Fixture]) -> dict[str, Fixture]:
+    """Replay key: path and query. Recordings of different hosts with the same path overwrite each other"""
+    routes = {}
+    for fixture in fixtures:
+        parts = urlsplit(fixture.url)
+        routes[(parts.path or "/") + ("?" + parts.query if parts.query else "")] = fixture
+    return routes
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, like the browser expects
+    routes: dict[str, Fixture] = {}
+    hosts: set[str] = set() # recorded hosts, redirects to them are rewritten to this server
+    latency = 0.0 # seconds before each response
+    bandwidth = 0 # bytes per second, 0 for unlimited
+    chunk_size = 0 # send Transfer-Encoding: chunked bodies in pieces this big, 0 for Content-Length
+
+    def do_GET(self):
+        fixture = self.routes.get(self.path)
+        if fixture is None:
+            fixture = Fixture(404, [("Content-Type", "text/plain")], b"not recorded: " + self.path.encode())
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(fixture.status)
+        for name, value in fixture.headers:
+            if name.lower() == "location":
+                value = self.local_location(value)
+            self.send_header(name, value)
+        if self.chunk_size:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(len(fixture.body)))
+        self.end_headers()
+
+        body = memoryview(fixture.body)
+        piece = self.chunk_size or 16384
+        for start in range(0, len(body), piece):
+            data = body[start:start + piece]
+            if self.chunk_size:
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            else:
+                self.wfile.write(data)
+            self.wfile.flush()
+            if self.bandwidth:
+                time.sleep(len(data) / self.bandwidth)
+        if self.chunk_size:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def local_location(self, location: str) -> str:
+        parts = urlsplit(location)
+        if parts.netloc not in self.hosts:
+            return location
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{parts.path or '/'}" + (f"?{parts.query}" if parts.query else "")
+
+    def log_message(self, *args):
+        pass
+
+def serve(fixtures: list[Fixture] | dict[str, Fixture], port=0, latency_ms=0, bandwidth_kbps=0, chunk_size=0) -> ThreadingHTTPServer:
+    """Replay server on a daemon thread. fixtures: recorded list, or path -> Fixture for made up pages"""
+    routes = fixtures if isinstance(fixtures, dict) else by_path(fixtures)
+    handler = type("Handler", (ReplayHandler,), {
+        "routes": routes,
+        "hosts": {urlsplit(fixture.url).netloc for fixture in routes.values() if fixture.url},
+        "latency": latency_ms / 1000,
+        "bandwidth": bandwidth_kbps * 1024,
+        "chunk_size": chunk_size,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def encode(body: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(body)
+    if encoding == "deflate":
+        return zlib.compress(body)
+    if encoding == "br":
+        return brotli.compress(body)
+    if encoding == "zstd":
+        return zstd.compress(body) if hasattr(zstd, "compress") else zstd.ZstdCompressor().compress(body)
+    raise ValueError(f"can't encode {encoding}")
+
+def check_encodings(chunk_sizes=(0, 3, 4096)) -> bool:
+    """Serve a page in each encoding the browser asks for, plain and chunked, and check URL.request decodes it"""
+    body = ("<p>" + "encoded body text " * 4000 + "</p>").encode()
+    encodings = [encoding.strip() for encoding in ACCEPT_ENCODING.split(",")]
+    routes = {"/" + encoding: Fixture(200, [("Content-Encoding", encoding)], encode(body, encoding)) for encoding in encodings}
+    raw = zlib.compressobj(wbits=-15)
+    routes["/deflate-raw"] = Fixture(200, [("Content-Encoding", "deflate")], raw.compress(body) + raw.flush())
+    routes["/chained"] = Fixture(200, [("Content-Encoding", f"{encodings[0]}, gzip")], gzip.compress(encode(body, encodings[0])))
+    
+    passed = True
+    for chunk_size in chunk_sizes:
+        server = serve(routes, chunk_size=chunk_size)
+        for path in routes:
+            url = URL(f"http://127.0.0.1:{server.server_port}{path}")
+            try:
+                with contextlib.redirect_stdout(io.StringIO()): # request prints its progress
+                    result = "ok" if url.request() == body.decode() else "FAILED: body differs"
+            except Exception as e:
+                result = f"FAILED: {type(e).__name__}: {e}"
+            passed = passed and result == "ok"
+            print(f"{path[1:]:>12} chunk {chunk_size:<5} {result}")
+        server.shutdown()
+    return passed
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Record and replay http responses")
+    commands = argparser.add_subparsers(dest="command", required=True)
+    record_args = commands.add_parser("record", help="fetch urls into an archive")
+    record_args.add_argument("archive")
+    record_args.add_argument("urls", nargs="+")
+    replay_args = commands.add_parser("replay", help="serve an archive locally")
+    replay_args.add_argument("archive")
+    replay_args.add_argument("--port", type=int, default=8000)
+    replay_args.add_argument("--latency", type=float, default=0, help="ms before each response")
+    replay_args.add_argument("--bandwidth", type=float, default=0, help="KiB/s, 0 for unlimited")
+    replay_args.add_argument("--chunk", type=int, default=0, help="chunked transfer encoding with chunks of this many bytes")
+    commands.add_parser("check-encodings", help="round-trip every advertised content-encoding through URL.request")
+    args = argparser.parse_args()
+
+    if args.command == "record":
+        save(record(args.urls), args.archive)
+        print("wrote", args.archive)
+    elif args.command == "check-encodings":
+        sys.exit(0 if check_encodings() else 1)
+    else:
+        fixtures = load(args.archive)
+        server = serve(fixtures, args.port, args.latency, args.bandwidth, args.chunk)
+        for path in by_path(fixtures):
+            print(f"http://127.0.0.1:{server.server_port}{path}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
@@ -12,10 +12,32 @@ import binascii
 # except ImportError:
 #     _PANGO_AVAILABLE = False
 _PANGO_AVAILABLE = False
+_FIXED_METRICS = False # see use_fixed_metrics
 
 _font_cache = {}
 _width_cache = collections.defaultdict(dict)
 
+class FixedMetricsFont:
+    """Tk-free stand-in for tkinter.font.Font with deterministic metrics: every character is
+    half an em wide. For headless rendering where no display is available, widths are only approximate"""
+    def __init__(self, family="Segoe UI", size=16, slant="roman", weight="normal"):
+        self.family, self.size, self.slant, self.weight = family, size, slant, weight
+        self.px = size * 4 / 3 # tk sizes are in points
+        
+    def metrics(self, *options):
+        ascent, descent = round(self.px * 0.8), round(self.px * 0.2) + 1
+        return {"ascent": ascent, "descent": descent, "linespace": ascent + descent, "fixed": 0}
+    
+    def measure(self, text):
+        return round(len(text) * self.px * (0.55 if self.weight == "bold" else 0.5))
+    
+def use_fixed_metrics():
+    """Measure text with FixedMetricsFont instead of Tk from now on"""
+    global _FIXED_METRICS
+    _FIXED_METRICS = True
+    _font_cache.clear()
+    _width_cache.clear()
+
 def get_width(word, font):
     font_id = font.id
     if word in _width_cache[font_id]:
@@ -39,7 +61,8 @@ def get_font(family="Segoe UI", size=16, style="roman", weight="normal"):
         (hash16(family) & 0xFFFF) << 10
     )
     if key_int not in _font_cache:
-        font = tkinter.font.Font(family=family,size=int(size),slant=style,weight=weight)
+        font_class = FixedMetricsFont if _FIXED_METRICS else tkinter.font.Font
+        font = font_class(family=family,size=int(size),slant=style,weight=weight)
         font.id = key_int
         font.cached_metrics = font.metrics()
         if _PANGO_AVAILABLE:
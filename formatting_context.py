@@ -1,20 +1,40 @@
+from bisect import bisect_right
+from itertools import accumulate
 import re
 import tkinter
 from font_cache import get_font, get_width
 from layout import BlockLayout, BreakLayout, Layout, LineLayout, TextFragment, AnonymousLayout, flatten
 
 class BlockFormattingContext():
-    def __init__(self, block: Layout):
+    def __init__(self, block: Layout, until=None):
         self.block = block
         self.style = block.computed_style()
+        self.until = until # lazy layout: stop at block children starting below this y
         
     def format(self):
-        self.block.x = self.block.parent.x
+        x = self.block.parent.x
+        y = self.block.previous.y + self.block.previous.height if self.block.previous else self.block.parent.y
+        width = self.block.parent.width
+        has_inline_children = self.block.has_inline_children()
+        
+        fixed_width = self.style.get("width", "auto")
+        if not has_inline_children and fixed_width.endswith("px"):
+            width = int(fixed_width[:-2])
+            
+        # same width and style as last pass, so the subtree's line boxes are still valid. just move them
+        cache = self.block.layout_cache
+        if cache and cache[0] == width and cache[1] is self.style:
+            self.block.translate(x - self.block.x, y - self.block.y)
+            return
+        
+        self.block.x = x
+        self.block.y = y
+        self.block.partial = False
         self.block.width = self.block.parent.width
-        self.block.y = self.block.previous.y + self.block.previous.height if self.block.previous else self.block.parent.y
         self.block.line_boxes = []  # Reset line_boxes from previous layout pass
+        self.block.layout_cache = (width, self.style)
         
-        if self.block.has_inline_children():
+        if has_inline_children:
             # inline formatter over entire block
             # (if has inline children, entire block must ONLY contain inline children)
             inline = InlineFormattingContext(self.block)
@@ -22,20 +42,41 @@ class BlockFormattingContext():
             self.block.height = sum([line.height for line in self.block.line_boxes])
             return
 
-        width = self.style.get("width", "auto")
         height = self.style.get("height", "auto")
-        if width.endswith("px"):
-            self.block.width = int(width[:-2])
+        self.block.width = width
         if height.endswith("px"):
             self.block.height = int(height[:-2])
         
         # format block children
-        for child in self.block.children:
+        child_y = y
+        for i, child in enumerate(self.block.children):
             assert isinstance(child, (BlockLayout, AnonymousLayout))
-            ctx = BlockFormattingContext(child)
+            if self.until is not None and child_y > self.until:
+                self.defer_children(i)
+                return
+            ctx = BlockFormattingContext(child, self.until)
             ctx.format()
+            child_y = child.y + child.height
+            # a partially laid out child reached the limit, so its siblings below are out of range too
+            if child.partial:
+                self.defer_children(i + 1)
+                return
 
         self.block.height = sum([child.height for child in self.block.children])
+        
+    def defer_children(self, start):
+        """Lazy layout: leave children[start:] unlaid and estimate their height from the laid out ones"""
+        laid_out = self.block.children[:start]
+        remaining = self.block.children[start:]
+        for child in remaining:
+            child.x = child.y = None
+            child.layout_cache = None
+        # a partial child already includes its own estimate, only average over complete ones
+        complete = [child.height for child in laid_out if not child.partial]
+        estimate = sum(complete) / len(complete) * len(remaining) if complete else 0
+        self.block.height = sum([child.height for child in laid_out]) + estimate
+        self.block.partial = True
+        self.block.layout_cache = None
     
 class InlineFormattingContext():
     def __init__(self, block: Layout):
@@ -81,18 +122,57 @@ class InlineFormattingContext():
                             self.flush_line(layout.node)
                     continue
                 
-                # split into fragments, add each fragment to curr_line while checking for wrap
+                # break the whole run into line spans, wrapping with prefix sums
                 clean_text = self.normalize_text(layout.text_run)
-                fragments = clean_text.split(" ")
-                for i, fragment in enumerate(fragments):
-                    end = "" if i == len(fragments)-1 else " "
-                    self.add_fragment_to_line(fragment, font, color, layout, pre=False, end=end)
+                self.add_run_to_line(clean_text, font, color, layout)
 
         if self.curr_line.children:
             self.flush_line(self.block.node)
             
         return self.out
         
+    def add_run_to_line(self, text: str, font: tkinter.font.Font, color: str, layout_object):
+        """Measure every word of a run once, then bisect prefix sums for each line's break point.
+        Emits one TextFragment per (line, run) span instead of one per word"""
+        words = text.split(" ")
+        clean_words = [word.replace("\u00AD", "") for word in words]
+        space_w = get_width(" ", font)
+        advances = [get_width(word, font) + space_w for word in clean_words]
+        advances[-1] -= space_w # last word of a run has no trailing space
+        prefix = list(accumulate(advances, initial=0))
+        
+        i, n = 0, len(words)
+        while i < n:
+            # remove whitespace at the beginning of boxes
+            if words[i] == "" and self.cx == 0:
+                i += 1
+                continue
+            
+            # furthest j such that words[i:j] still fit on the current line
+            j = bisect_right(prefix, prefix[i] + self.available_width - self.cx, i) - 1
+            if j > i:
+                # span text keeps its trailing space so it matches the measured width
+                span = " ".join(clean_words[i:j]) + (" " if j < n else "")
+                self.add_span_to_line(span, prefix[j] - prefix[i], font, color, layout_object)
+                i = j
+                continue
+            
+            # words[i] overflows the line
+            if "\u00AD" in words[i]:
+                end = "" if i == n-1 else " "
+                self.add_fragment_to_line(words[i], font, color, layout_object, pre=False, end=end)
+                i += 1
+            elif self.cx == 0:
+                # wider than an empty line, place it alone
+                self.add_span_to_line(clean_words[i] + (" " if i < n-1 else ""), advances[i], font, color, layout_object)
+                i += 1
+            else:
+                self.flush_line(layout_object.node)
+    
+    def add_span_to_line(self, text: str, width: int, font: tkinter.font.Font, color: str, layout_object):
+        self.curr_line.children.append(TextFragment(layout_object, text, self.x + self.cx, self.y + self.cy, width, font, color))
+        self.cx += width
+        
     def add_fragment_to_line(self, fragment: str, font: tkinter.font.Font, color: str, layout_object, pre=False, end=" "):
         # remove whitespace at the beginning of boxes
         if not pre and fragment == "" and self.cx == 0:
@@ -115,7 +195,7 @@ class InlineFormattingContext():
                 self.add_fragment_to_line(righthalf, font, color, layout_object, pre=pre)
                 return
 
-        frag = TextFragment(layout_object, fragment_without_hyphen, self.x + self.cx, self.y + self.cy, w, font, color)
+        frag = TextFragment(layout_object, fragment_without_hyphen + ("" if pre else end), self.x + self.cx, self.y + self.cy, w, font, color)
         self.cx += w
         self.curr_line.children.append(frag)
         
@@ -0,0 +1,63 @@
+from collections import deque
+import math
+import time
+
+FRAME_TARGET_MS = 8 # frame budget, same as the browser's frame interval
+ROLLING_FRAMES = 240 # frames (and input events) the percentiles are taken over
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+class FrameMetrics:
+    """Per-frame duration, canvas item churn, dropped frames and input-to-frame latency.
+    A frame ends when Browser.update returns, Tk paints the canvas right after that"""
+    def __init__(self):
+        self.frame_ms = deque(maxlen=ROLLING_FRAMES)
+        self.latency_ms = deque(maxlen=ROLLING_FRAMES)
+        self.created = deque(maxlen=ROLLING_FRAMES) # canvas items created per frame
+        self.deleted = deque(maxlen=ROLLING_FRAMES)
+        self.frames = 0
+        self.dropped = 0 # frame intervals missed because a frame overran the target
+        self.pending_inputs = [] # (kind, time) of inputs not painted yet
+        self.latency_by_kind = {} # kind -> deque of latencies
+        self.frame_start_time = 0
+
+    def input(self, kind: str):
+        """An input event (key, wheel, click) arrived, its latency ends with the next frame"""
+        self.pending_inputs.append((kind, time.perf_counter()))
+
+    def frame_start(self):
+        self.frame_start_time = time.perf_counter()
+
+    def frame_end(self, created: int, deleted: int):
+        end = time.perf_counter()
+        duration = (end - self.frame_start_time) * 1000
+        self.frames += 1
+        self.frame_ms.append(duration)
+        self.dropped += max(0, math.ceil(duration / FRAME_TARGET_MS) - 1)
+        self.created.append(created)
+        self.deleted.append(deleted)
+        for kind, start in self.pending_inputs:
+            latency = (end - start) * 1000
+            self.latency_ms.append(latency)
+            self.latency_by_kind.setdefault(kind, deque(maxlen=ROLLING_FRAMES)).append(latency)
+        self.pending_inputs = []
+
+    def summary(self) -> dict:
+        return {
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "frame_ms": {f"p{p}": percentile(self.frame_ms, p) for p in (50, 95, 99)},
+            "latency_ms": {f"p{p}": percentile(self.latency_ms, p) for p in (50, 95, 99)},
+            "latency_ms_by_input": {kind: percentile(values, 95) for kind, values in self.latency_by_kind.items()},
+            "items_per_frame": {"created": sum(self.created) / max(len(self.created), 1),
+                                "deleted": sum(self.deleted) / max(len(self.deleted), 1)},
+        }
+
+    def hud_text(self) -> str:
+        last = self.frame_ms[-1] if self.frame_ms else 0
+        return (f"frame {last:.1f}ms p95 {percentile(self.frame_ms, 95):.1f}ms  dropped {self.dropped}\n"
+                f"input p95 {percentile(self.latency_ms, 95):.1f}ms  items +{self.created[-1] if self.created else 0} -{self.deleted[-1] if self.deleted else 0}")
@@ -0,0 +1,66 @@
+import random
+import sys
+import time
+import tkinter
+from font_cache import use_fixed_metrics
+from layout import AnonymousLayout, BlockLayout, DocumentLayout, HitTestIndex, tree_to_list
+from layout_bench import make_document, styled_tree
+
+# click latency: walking the whole layout tree (what get_layout_at_coords used to do) vs HitTestIndex
+
+def tree_walk_layout_at(document, x, y):
+    objs = []
+    for obj in tree_to_list(document):
+        if not isinstance(obj, (BlockLayout, AnonymousLayout)):
+            continue
+        if obj.x <= x < obj.x + obj.width and obj.y <= y < obj.y + obj.height:
+            objs.append(obj)
+        for line in obj.line_boxes:
+            if y < line.y or y >= line.y + line.height:
+                continue
+            for fragment in line.children:
+                if fragment.x <= x < fragment.x + fragment.width:
+                    objs.append(fragment.parent_layout)
+    return objs[-1] if objs else None
+
+if __name__ == "__main__":
+    # fonts need a Tk root to measure text, without a display use fixed metrics
+    try:
+        tkinter.Tk().withdraw()
+    except tkinter.TclError:
+        print("no display, measuring text with fixed metrics")
+        use_fixed_metrics()
+    target_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    width = 1280
+    clicks = 200
+    
+    # grow the document until it has enough lines
+    paragraphs = 100
+    while True:
+        document = DocumentLayout(styled_tree(make_document(paragraphs)), None)
+        document.layout(width=width)
+        start_time = time.perf_counter()
+        index = HitTestIndex(document)
+        index.build()
+        build_time = time.perf_counter() - start_time
+        if len(index.lines) >= target_lines:
+            break
+        paragraphs = paragraphs * target_lines // len(index.lines) + 1
+    
+    random.seed(0)
+    points = [(random.uniform(0, width), random.uniform(0, document.height)) for _ in range(clicks)]
+    
+    start_time = time.perf_counter()
+    for x, y in points[:clicks // 10]:
+        tree_walk_layout_at(document, x, y)
+    walk_time = (time.perf_counter() - start_time) / (clicks // 10)
+    
+    start_time = time.perf_counter()
+    for x, y in points:
+        index.layout_at(x, y)
+    index_time = (time.perf_counter() - start_time) / clicks
+    
+    mismatches = sum(tree_walk_layout_at(document, x, y) is not index.layout_at(x, y) for x, y in points[:clicks // 10])
+    print(f"{len(index.lines)} lines, index built in{build_time*1000: .2f}ms")
+    print(f"tree walk: {walk_time*1000: .3f}ms per click")
+    print(f"    index: {index_time*1000: .3f}ms per click ({mismatches} mismatches)")
@@ -1,7 +1,8 @@
+from bisect import bisect_right
 from dataclasses import dataclass
 import tkinter
 from typing import Iterator, Optional
-from draw import DrawRect, DrawText, Rect
+from draw import DrawRect, DrawText, Rect, SpatialIndex
 from font_cache import get_font
 from html_parser import Element, Text
 
@@ -28,26 +29,54 @@ class Layout:
         self.children = []
         self.x = self.y = self.width = self.height = None
         self.line_boxes = [] # computed lines to paint from self.children
+        self.layout_cache = None # (width, style) the current line boxes were computed for
+        self.partial = False # lazy layout stopped before reaching the end of this box
 
     def self_rect(self):
         return Rect(self.x, self.y, self.x+self.width, self.y+self.height)
 
     def computed_style(self):
         return self.node.style if self.node else None
+    
+    def translate(self, dx, dy):
+        """Shift this box, its line boxes and its block children without recomputing them"""
+        if not dx and not dy:
+            return
+        self.x += dx
+        self.y += dy
+        for line in self.line_boxes:
+            line.x += dx
+            line.y += dy
+            for fragment in line.children:
+                fragment.x += dx
+                fragment.y += dy
+        for child in self.children:
+            if isinstance(child, (BlockLayout, AnonymousLayout)):
+                child.translate(dx, dy)
 
 class DocumentLayout(Layout):
     def __init__(self, node, canvas: tkinter.Canvas):
         super().__init__(node, None, None)
         self.canvas = canvas
     
-    def layout(self):
-        child = build_layout_for_node(self.node, self, None) # <html> node
-        self.children = [child]
-        self.width = self.canvas.winfo_width() - 2*MARGINS[0] - MARGINS[4]
+    def build(self):
+        """Construct the box tree from the styled DOM. Only needed again after a style change"""
+        self.children = [build_layout_for_node(self.node, self, None)] # <html> node
+    
+    def layout(self, width=None, until=None):
+        """Recompute geometry of the retained box tree for a viewport width (defaults to the canvas width).
+        With until, blocks starting below that y are left for a later pass and their height is estimated"""
+        if not self.children:
+            self.build()
+        child = self.children[0]
+        if width is None:
+            width = self.canvas.winfo_width()
+        self.width = width - 2*MARGINS[0] - MARGINS[4]
         self.x = MARGINS[0]
         self.y = MARGINS[1]
-        child.layout()
+        child.layout(until)
         self.height = child.height
+        self.partial = child.partial
         
     def paint(self):
         return []
@@ -60,6 +89,7 @@ class BlockLayout(Layout):
         self.pre = False
         self.current_font = get_font()
         self.cx = 0
+        self.background = None # DrawRect of the last paint, lazy layout resizes it in place
         
     def __repr__(self):
         tag = getattr(self.node, "tag", None)
@@ -73,6 +103,7 @@ class BlockLayout(Layout):
             if bgcolor != "transparent":
                 rect = DrawRect(self.self_rect(), bgcolor)
                 cmds.append(rect)                    
+                self.background = rect
                     
         return cmds
     
@@ -82,17 +113,17 @@ class BlockLayout(Layout):
                 return True
         return False
         
-    def layout(self):
+    def layout(self, until=None):
         from formatting_context import BlockFormattingContext
-        BlockFormattingContext(self).format()
+        BlockFormattingContext(self, until).format()
 
 class AnonymousLayout(Layout):
     def __init__(self, parent, previous):
         super().__init__(None, parent, previous)
         
-    def layout(self): 
+    def layout(self, until=None): 
         from formatting_context import BlockFormattingContext
-        BlockFormattingContext(self).format()
+        BlockFormattingContext(self, until).format()
         
     def computed_style(self):
         return self.parent.node.style
@@ -243,17 +274,37 @@ def flatten(layouts: list[Layout]) -> Iterator[TextLayout | BreakLayout]:
         else: # children somehow contain block layout
             assert False
         
-def paint_tree(layout_object: Layout, display_list):
+def paint_tree(layout_object: Layout, display_list) -> int:
+    """Returns the number of text fragments painted"""
     display_list.extend(layout_object.paint())
     
     if layout_object.line_boxes != []:
-        paint_inline(layout_object.line_boxes, display_list)
-        return 
+        return paint_inline(layout_object.line_boxes, display_list)
     
+    fragments = 0
     for child in layout_object.children:
-        if isinstance(child, (DocumentLayout, BlockLayout, AnonymousLayout)):
-            paint_tree(child, display_list)
+        if isinstance(child, (DocumentLayout, BlockLayout, AnonymousLayout)) and child.y is not None:
+            fragments += paint_tree(child, display_list)
+    return fragments
             
+# lazy layout only ever defers a tail of the tree in paint order, so a continuation pass
+# paints just that tail after the existing display list. The blocks it cut off (the spine,
+# document down to the deepest partial block) are the only painted boxes whose geometry changes
+def lazy_spine(document: Layout) -> list[tuple[Layout, int]]:
+    """(block, index of its first deferred child) for each partial block, outermost first"""
+    spine = []
+    block = document
+    while block is not None and block.partial:
+        first = next(i for i, child in enumerate(block.children) if child.partial or child.y is None)
+        child = block.children[first]
+        spine.append((block, first + 1 if child.partial else first))
+        block = child if child.partial else None
+    return spine
+
+def deferred_blocks(spine: list[tuple[Layout, int]]) -> list[Layout]:
+    """Children deferred below the spine that are laid out now, in paint order"""
+    return [child for block, first in reversed(spine) for child in block.children[first:] if child.y is not None]
+
 def print_layout_tree(layout_object: Layout):
     def _print(node: Layout, depth: int):
         indent = ".." * depth
@@ -268,12 +319,24 @@ def print_layout_tree(layout_object: Layout):
     _print(layout_object, 0)
     
 # only text fragments can be painted
-def paint_inline(line_boxes, display_list):
+# consecutive fragments on a line with the same font and color are merged into one DrawText,
+# the fragments themselves are kept as-is for hit testing
+def paint_inline(line_boxes, display_list) -> int:
+    fragments = 0
     for line in line_boxes:
+        run = None # DrawText currently being extended on this line
+        fragments += len(line.children)
         for text_frag in line.children:
+            if not text_frag.text:
+                continue
+            if run and run.font is text_frag.font and run.color == text_frag.color \
+                    and run.top == text_frag.y and run.rect.right == text_frag.x:
+                run.extend(text_frag.text, text_frag.width)
+                continue
             paint = text_frag.paint()
-            if paint:
-                display_list.extend(paint)
+            display_list.extend(paint)
+            run = paint[-1]
+    return fragments
             
 def print_paint(display_list):
     for cmd in display_list:
@@ -291,5 +354,86 @@ def tree_to_fragment_list(tree: Layout):
             
     if isinstance(tree, (DocumentLayout, BlockLayout, AnonymousLayout)):
         for child in tree.children:
-            yield from tree_to_fragment_list(child)
-    
\ No newline at end of file
+            if child.y is not None: # skip boxes left unlaid by lazy layout
+                yield from tree_to_fragment_list(child)
+
+class HitTestIndex:
+    """Made once per layout pass: line boxes sorted by y and each line's fragments by x,
+    so a click bisects to its fragment instead of walking the layout tree.
+    The arrays are filled in on the first click, relayouts nobody clicks on don't pay for them"""
+    def __init__(self, document: Layout):
+        self.document = document
+        self.lines = None
+    
+    def build(self):
+        self.blocks = []
+        stack = [self.document]
+        while stack:
+            layout = stack.pop()
+            if isinstance(layout, (BlockLayout, AnonymousLayout)):
+                self.blocks.append(layout)
+            # reversed, so blocks come out in paint order
+            stack.extend(child for child in reversed(layout.children) if isinstance(child, (BlockLayout, AnonymousLayout)) and child.y is not None)
+        self.block_index = SpatialIndex(self.blocks, rect=Layout.self_rect)
+        
+        self.lines = self.block_lines(self.blocks)
+        self.line_tops = [line.y for line in self.lines]
+        self.fragment_xs = [[fragment.x for fragment in line.children] for line in self.lines]
+        
+    def block_lines(self, blocks) -> list[LineLayout]:
+        lines = [line for block in blocks for line in block.line_boxes if line.height > 0 and line.children]
+        lines.sort(key=lambda line: line.y) # already in order unless fixed heights make boxes overlap
+        return lines
+    
+    def extend(self, roots: list[Layout], grown: list[Layout]):
+        """Lazy layout continuation: index the new subtrees roots, and the blocks in grown again.
+        Nothing to do until the first click builds the index"""
+        if self.lines is None:
+            return
+        start = len(self.blocks)
+        for root in roots:
+            stack = [root]
+            while stack:
+                layout = stack.pop()
+                self.blocks.append(layout)
+                stack.extend(child for child in reversed(layout.children) if isinstance(child, (BlockLayout, AnonymousLayout)) and child.y is not None)
+        for i in range(start, len(self.blocks)):
+            self.block_index.add(i)
+        for block in grown:
+            self.block_index.add(self.blocks.index(block))
+        
+        lines = self.block_lines(self.blocks[start:])
+        if lines and self.lines and lines[0].y < self.lines[-1].y:
+            self.lines = None # overlaps the old lines, rebuild on the next click
+            return
+        self.lines += lines
+        self.line_tops += [line.y for line in lines]
+        self.fragment_xs += [[fragment.x for fragment in line.children] for line in lines]
+        
+    def fragment_at(self, x, y) -> TextFragment | None:
+        if self.lines is None:
+            self.build()
+        i = bisect_right(self.line_tops, y) - 1
+        if i < 0:
+            return None
+        line = self.lines[i]
+        if y >= line.y + line.height:
+            return None
+        j = bisect_right(self.fragment_xs[i], x) - 1
+        if j < 0:
+            return None
+        fragment = line.children[j]
+        if x < fragment.x + fragment.width:
+            return fragment
+        return None
+    
+    def layout_at(self, x, y) -> Layout | None:
+        """Text under the point if any, otherwise the innermost block containing it"""
+        fragment = self.fragment_at(x, y)
+        if fragment:
+            return fragment.parent_layout
+        for i in reversed(self.block_index.query(y, y)):
+            block = self.blocks[i]
+            if block.x <= x < block.x + block.width and block.y <= y < block.y + block.height:
+                return block
+        return None
@@ -0,0 +1,70 @@
+import itertools
+import sys
+import time
+import tkinter
+from css_parser import CSSParser, style
+from font_cache import use_fixed_metrics
+from html_parser import HTMLParser
+from layout import DocumentLayout
+
+# compares a full layout (box tree construction + geometry) against relayout of the retained box tree,
+# which is what a window resize costs
+
+def make_document(paragraphs: int) -> str:
+    out = ["<html><body>"]
+    for i in range(paragraphs):
+        out.append(f"<h2>Section {i}</h2>")
+        out.append(f"<p>Paragraph {i}: the quick brown fox <b>jumps over</b> the lazy dog, "
+                   f"<i>again and again</i>, while <a href='#{i}'>a link</a> sits in the middle "
+                   f"of a sentence long enough to wrap several times at most window widths.</p>")
+        out.append("<div style='width:400px'><p>fixed width block that survives a resize untouched</p></div>")
+    out.append("</body></html>")
+    return "".join(out)
+
+def styled_tree(body: str):
+    parser = CSSParser(open("browser.css").read())
+    rules = parser.parse(origin_priority=1)
+    root = HTMLParser(body).parse()
+    style(root, rules, parser)
+    return root
+
+def bench(fn, iters):
+    times = []
+    for _ in range(iters):
+        start_time = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start_time)
+    return min(times), sum(times) / len(times)
+
+if __name__ == "__main__":
+    # fonts need a Tk root to measure text, without a display use fixed metrics
+    try:
+        tkinter.Tk().withdraw()
+    except tkinter.TclError:
+        print("no display, measuring text with fixed metrics")
+        use_fixed_metrics()
+    paragraphs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    iters = 5
+    widths = [1280, 1000, 800, 1200, 900]
+    
+    rootnode = styled_tree(make_document(paragraphs))
+    
+    def full_rebuild():
+        document = DocumentLayout(rootnode, None)
+        document.build()
+        document.layout(width=widths[0])
+    
+    document = DocumentLayout(rootnode, None)
+    document.build()
+    document.layout(width=widths[0])
+    resize = itertools.cycle(widths[1:] + widths[:1]) # every call changes the width
+    def relayout_resize():
+        document.layout(width=next(resize))
+        
+    def relayout_same_width():
+        document.layout(width=widths[0])
+
+    for name, fn in [("full rebuild", full_rebuild), ("relayout, new width", relayout_resize), ("relayout, same width", relayout_same_width)]:
+        fn() # warmup, also settles the width before the same-width run
+        best, mean = bench(fn, iters)
+        print(f"{name:>22}: best{best*1000: .2f}ms mean{mean*1000: .2f}ms ({paragraphs} paragraphs)")
@@ -0,0 +1,178 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+import queue
+import threading
+import time
+from css_parser import CSSParser, Rule, style
+from html_parser import Element, HTMLParser, Text
+from layout import tree_to_list
+from tracing import span
+from url import URL
+
+LOAD_POLL_MS = 16 # how often the main loop checks on a running load
+PROGRESSIVE_MS = 250 # progressive mode: minimum time between partial renders
+PROGRESSIVE_FIRST_CHARS = 32768 # progressive mode: prefix rendered first when a large body arrives at once
+PROGRESSIVE_GROWTH = 2 # progressive mode: each partial render is for a prefix at least this many times longer than the last,
+                       # every one reparses and restyles the whole prefix, so this keeps the total work linear in the body
+
+# background tab prefetches run one at a time so they don't compete with each other or with a foreground load for long
+prefetch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+
+class LoadCancelled(Exception):
+    pass
+
+def prefetch(url: URL) -> Future:
+    """Fetch the body of a page that isn't shown yet, queued behind other prefetches.
+    Fetched on a copy of url, the result is (the copy after redirects, body)"""
+    fetched = url.copy()
+    return prefetch_pool.submit(lambda: (fetched, fetched.request()))
+
+@dataclass
+class LoadResult:
+    url: URL
+    rootnode: Element = None
+    rules: list[Rule] = field(default_factory=list)
+    title: str | None = None
+    style_time: float = 0
+    error: Exception | None = None
+    partial: bool = False # styled prefix of a page that is still loading
+    first: bool = True # first result delivered for this load
+
+def style_prefix(url: URL, body: str, default_rules: list[Rule]) -> LoadResult:
+    """Parse and style the part of a page received so far, with the default and <style> rules only"""
+    result = LoadResult(url, partial=True)
+    with span("parse", partial=True, chars=len(body)):
+        result.rootnode = HTMLParser(body).parse()
+    result.rules = default_rules.copy()
+    start_time = time.perf_counter()
+    with span("style", partial=True):
+        style(result.rootnode, result.rules, CSSParser(""))
+    result.style_time = time.perf_counter() - start_time
+    return result
+
+def fetch_and_style(url: URL, default_rules: list[Rule], cancelled: threading.Event | None = None, on_partial=None, prefetched: Future | None = None) -> LoadResult:
+    """Network, parsing, stylesheet fetches and style, everything in a page load that doesn't touch Tk.
+    With on_partial, the prefix received so far is styled and passed to it every PROGRESSIVE_MS.
+    prefetched: body from prefetch(), used if it has started, otherwise it's dropped and the page fetched now"""
+    def check():
+        if cancelled and cancelled.is_set():
+            raise LoadCancelled()
+    
+    last_partial = time.perf_counter()
+    last_size = 0
+    partials = 0
+    def on_body(content):
+        nonlocal last_partial, last_size, partials
+        if time.perf_counter() - last_partial < PROGRESSIVE_MS / 1000 or len(content) < last_size * PROGRESSIVE_GROWTH \
+                or (cancelled and cancelled.is_set()):
+            return
+        # a multi-byte character may be cut off at the end of the prefix
+        on_partial(style_prefix(url, bytes(content).decode("utf-8", errors="ignore"), default_rules))
+        last_partial = time.perf_counter()
+        last_size = len(content)
+        partials += 1
+
+    body = None
+    if prefetched and not prefetched.cancel():
+        try:
+            url, body = prefetched.result()
+        except Exception:
+            pass # fetch it again, reporting the error from there
+    result = LoadResult(url)
+    if body is None:
+        with span("fetch", url=str(url)):
+            body = url.request(on_body=on_body if on_partial else None)
+    check()
+    # whole body arrived at once (local file or fast network), show its beginning before parsing the rest
+    if on_partial and not partials and len(body) > PROGRESSIVE_FIRST_CHARS:
+        on_partial(style_prefix(url, body[:PROGRESSIVE_FIRST_CHARS], default_rules))
+        check()
+    with span("parse", chars=len(body)):
+        result.rootnode = HTMLParser(body).parse()
+    check()
+
+    # css rules, own parser so concurrent loads don't share parser state
+    css_parser = CSSParser("")
+    result.rules = default_rules.copy()
+    for node in tree_to_list(result.rootnode):
+        # external stylesheets
+        if isinstance(node, Element) and node.tag == "link" and node.attributes.get("rel") == "stylesheet" and "href" in node.attributes:
+            style_url = url.resolve(node.attributes['href'])
+            try:
+                with span("stylesheet fetch", url=str(style_url)):
+                    body = style_url.request()
+                result.rules.extend(css_parser.parse(origin_priority=1, s=body))
+            except:
+                print("Could not fetch stylesheet from", style_url)
+            check()
+
+        elif isinstance(node, Text) and node.parent.tag == "title":
+            result.title = node.text
+
+    start_time = time.perf_counter()
+    with span("style", rules=len(result.rules)):
+        style(result.rootnode, result.rules, css_parser)
+    result.style_time = time.perf_counter() - start_time
+    return result
+
+class PageLoader:
+    """Runs fetch_and_style on a worker thread so the Tk event loop keeps handling input.
+    Layout measures fonts through Tk, so it stays on the main thread: the finished result
+    is picked up by polling with widget.after and handed to on_done there.
+    The worker fetches through its own copy of the URL: after a cancel it may still be reading,
+    and a later load of the same history entry mustn't share its connection or redirects"""
+    def __init__(self, url: URL, default_rules: list[Rule], widget, on_done, progressive=False, prefetched: Future | None = None):
+        """progressive: also hand partial results (LoadResult.partial) to on_done while loading
+        prefetched: see fetch_and_style"""
+        self.url = url
+        self.fetch_url = url.copy()
+        self.prefetched = prefetched
+        self.default_rules = default_rules
+        self.widget = widget
+        self.on_done = on_done
+        self.progressive = progressive
+        self.cancelled = threading.Event()
+        self.results = queue.Queue()
+        self.pending_poll = None
+        self.delivered = False
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        self.pending_poll = self.widget.after(LOAD_POLL_MS, self._poll)
+
+    def cancel(self):
+        """The user navigated away. A blocking socket read can't be interrupted,
+        but the worker stops at its next check and its result is dropped"""
+        self.cancelled.set()
+        if self.pending_poll:
+            self.widget.after_cancel(self.pending_poll)
+            self.pending_poll = None
+
+    def _run(self):
+        threading.current_thread().name = "loader"
+        try:
+            on_partial = self.results.put if self.progressive else None
+            result = fetch_and_style(self.fetch_url, self.default_rules, self.cancelled, on_partial, self.prefetched)
+        except LoadCancelled:
+            return
+        except Exception as e:
+            result = LoadResult(self.fetch_url, error=e)
+        self.results.put(result)
+
+    def _poll(self):
+        self.pending_poll = None
+        if self.cancelled.is_set():
+            return
+        # only the newest of any queued results is worth showing
+        result = None
+        while not self.results.empty():
+            result = self.results.get_nowait()
+        if result:
+            # results name the history entry, moved to wherever redirects led
+            self.url.follow(result.url)
+            result.url = self.url
+            result.first = not self.delivered
+            self.delivered = True
+            self.on_done(result)
+        if not result or result.partial:
+            self.pending_poll = self.widget.after(LOAD_POLL_MS, self._poll)
@@ -0,0 +1,94 @@
+import gc
+import sys
+import tkinter
+import tkinter.font
+import types
+from canvas_backend import HeadlessWindow, RecordingCanvas
+from css_parser import Rule
+from draw import DrawLine, DrawOutline, DrawRect, DrawText
+from font_cache import FixedMetricsFont
+from html_parser import Element, Text
+from layout import Layout, TextFragment, tree_to_list
+
+# page_footprint: rough per-page memory figure, used to keep caches of pages within a budget
+# memory_report: counts and deep sizes per structure of a page, for finding where the memory goes
+
+# each structure's objects are counted in its own bucket, walks from other structures stop at them
+STRUCTURAL = (Element, Text, Rule, Layout, TextFragment, DrawText, DrawRect, DrawOutline, DrawLine)
+# shared by every page, not counted
+SHARED = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+          tkinter.Misc, tkinter.font.Font, FixedMetricsFont, RecordingCanvas, HeadlessWindow)
+BUILTINS = (str, bytes, int, float, bool, list, tuple, dict, set, frozenset, type(None))
+
+def object_bytes(obj) -> int:
+    """The object and its style dict / text if it has them.
+    Doesn't touch __dict__, on python 3.12 that would allocate a dict for every object it measures"""
+    size = sys.getsizeof(obj)
+    style = getattr(obj, "style", None)
+    if isinstance(style, dict):
+        size += sys.getsizeof(style)
+    text = getattr(obj, "text", None)
+    if isinstance(text, str):
+        size += sys.getsizeof(text)
+    return size
+
+def page_footprint(rootnode, document, display_list) -> int:
+    """Approximate bytes held by a loaded page: DOM, layout tree with its line boxes and fragments, display list"""
+    size = 0
+    if rootnode:
+        size += sum(object_bytes(node) for node in tree_to_list(rootnode))
+    if document:
+        for layout in tree_to_list(document):
+            size += object_bytes(layout)
+            for line in layout.line_boxes:
+                size += object_bytes(line) + sum(object_bytes(fragment) for fragment in line.children)
+    size += sum(object_bytes(cmd) for cmd in display_list)
+    return size
+
+def deep_bytes(roots, seen: set[int]) -> int:
+    """Bytes of roots and everything they reference that isn't STRUCTURAL, SHARED or already in seen.
+    Uses gc.get_referents rather than __dict__ so measuring doesn't allocate attribute dicts"""
+    total = 0
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        refs = gc.get_referents(obj)
+        total += sys.getsizeof(obj)
+        if not isinstance(obj, BUILTINS):
+            total += 8 * len(refs) # attribute values stored inline in the object, not included by getsizeof
+        stack.extend(ref for ref in refs if not isinstance(ref, STRUCTURAL) and not isinstance(ref, SHARED))
+    return total
+
+def memory_report(rootnode, rules, document, display_list, indexes=()) -> dict[str, dict[str, int]]:
+    """Structure -> {"count": objects, "bytes": deep size}. Objects shared between structures
+    (style strings, Rects) are counted once, in the first structure that reaches them"""
+    seen = set()
+    nodes = list(tree_to_list(rootnode)) if rootnode else []
+    layouts = list(tree_to_list(document)) if document else []
+    lines = [line for layout in layouts for line in layout.line_boxes]
+    fragments = [fragment for line in lines for fragment in line.children]
+    structures = [
+        ("dom", nodes, nodes),
+        ("rules", rules, [rules] + list(rules)),
+        ("layout tree", layouts, layouts),
+        ("line boxes", lines, lines),
+        ("fragments", fragments, fragments),
+        ("display list", display_list, [display_list] + list(display_list)),
+        ("indexes", [index for index in indexes if index], [index for index in indexes if index]),
+    ]
+    report = {name: {"count": len(objects), "bytes": deep_bytes(roots, seen)} for name, objects, roots in structures}
+    report["total"] = {"count": sum(entry["count"] for entry in report.values()),
+                       "bytes": sum(entry["bytes"] for entry in report.values())}
+    return report
+
+def tab_memory_report(tab) -> dict[str, dict[str, int]]:
+    return memory_report(tab.rootnode, tab.rules, tab.document, tab.display_list, (tab.display_index, tab.hit_index))
+
+def print_memory_report(report: dict[str, dict[str, int]], title=""):
+    if title:
+        print(title)
+    for name, entry in report.items():
+        print(f"  {name:>12}: {entry['count']:8} objects {entry['bytes'] / 1024:10.1f} KiB")
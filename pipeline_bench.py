@@ -0,0 +1,254 @@
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import time
+import tkinter
+import tracemalloc
+from css_parser import CSSParser, style
+import fixture_server
+from fixture_server import Fixture
+from font_cache import use_fixed_metrics
+from html_parser import Element, HTMLParser
+from layout import DocumentLayout, paint_tree, tree_to_list
+from memory import memory_report
+from url import URL
+
+# times every phase of a page load separately over a synthetic corpus served from a local http server
+# usage: python3 pipeline_bench.py [--repeat N] [--warmup N] [--scale N] [--json out.json] [--compare old.json]
+#        [--archive recorded.json] [--latency MS] [--bandwidth KBPS] [--chunk BYTES]
+
+PHASES = ["request", "parse", "style", "layout", "paint"]
+WORDS = "the quick brown fox jumps over the lazy dog while a patient reader scrolls past".split()
+
+def words(n: int, offset=0) -> str:
+    return " ".join(WORDS[(offset + i) % len(WORDS)] for i in range(n))
+
+def prose_page(scale: int) -> str:
+    out = ["<html><head><title>prose</title></head><body>"]
+    for i in range(200 * scale):
+        if i % 10 == 0:
+            out.append(f"<h2>Chapter {i // 10}</h2>")
+        out.append(f"<p>{words(60, i)} <b>{words(4, i)}</b> {words(30, i + 3)} <i>{words(5, i)}</i> {words(20, i + 7)}</p>")
+    out.append("</body></html>")
+    return "".join(out)
+
+def nested_page(scale: int) -> str:
+    depth = 100 * scale
+    out = ["<html><body>"]
+    for i in range(depth):
+        out.append(f"<div><p>level {i}: {words(8, i)}</p>")
+    out.append("</div>" * depth)
+    out.append("</body></html>")
+    return "".join(out)
+
+def list_table_page(scale: int) -> str:
+    out = ["<html><body><ul>"]
+    for i in range(1000 * scale):
+        out.append(f"<li>item {i} {words(6, i)}</li>")
+    out.append("</ul><table>")
+    for row in range(500 * scale):
+        out.append("<tr>" + "".join(f"<td>r{row}c{col}</td>" for col in range(6)) + "</tr>")
+    out.append("</table></body></html>")
+    return "".join(out)
+
+def css_heavy_page(scale: int) -> str:
+    out = ["<html><head><link rel='stylesheet' href='/heavy.css'><style>"]
+    for i in range(100 * scale):
+        out.append(f"div p.c{i} {{ color: #{i % 256:02x}2040; font-size: {12 + i % 8}px }}")
+    out.append("</style></head><body>")
+    for i in range(300 * scale):
+        out.append(f"<div class='c{i % 50}'><p class='c{i % 100}' style='margin-left: {i % 20}px'>{words(25, i)}</p></div>")
+    out.append("</body></html>")
+    return "".join(out)
+
+def heavy_stylesheet(scale: int) -> str:
+    return "\n".join(f".c{i} {{ background-color: #ee{i % 256:02x}ee; font-weight: {'bold' if i % 2 else 'normal'} }}"
+                     for i in range(200 * scale))
+
+def entity_page(scale: int) -> str:
+    entities = "&lt;tag&gt; &amp; &quot;quoted&quot; &copy; &nbsp; &ndash; &#169; &shy;"
+    out = ["<html><body>"]
+    for i in range(500 * scale):
+        out.append(f"<p>{words(10, i)} {entities} {words(10, i + 5)} {entities}</p>")
+    out.append("</body></html>")
+    return "".join(out)
+
+def make_corpus(scale: int) -> dict[str, str]:
+    """path -> body served by the local server, the pages are the ones ending in .html"""
+    return {
+        "/prose.html": prose_page(scale),
+        "/nested.html": nested_page(scale),
+        "/lists_tables.html": list_table_page(scale),
+        "/css_heavy.html": css_heavy_page(scale),
+        "/heavy.css": heavy_stylesheet(scale),
+        "/entities.html": entity_page(scale),
+    }
+
+def corpus_fixtures(corpus: dict[str, str]) -> dict[str, Fixture]:
+    return {path: Fixture(200, [("Content-Type", "text/css" if path.endswith(".css") else "text/html")], body.encode("utf-8"))
+            for path, body in corpus.items()}
+
+def recorded_pages(fixtures: list[Fixture]) -> dict[str, str]:
+    """name -> path of the html pages in a fixture_server archive"""
+    pages = {}
+    for path, fixture in fixture_server.by_path(fixtures).items():
+        content_type = dict((name.lower(), value) for name, value in fixture.headers).get("content-type", "")
+        if fixture.status == 200 and content_type.startswith("text/html"):
+            pages["recorded" + path.replace("/", "_").replace("?", "_")] = path
+    return pages
+
+def pipeline(url_str: str, default_css: str, width: int):
+    """The phases of loading url_str in order, each a function taking the previous phase's output"""
+    def fetch(url: URL) -> str:
+        # URL.request prints every request, keep that out of the timings' output
+        with contextlib.redirect_stdout(io.StringIO()):
+            body = url.request()
+        if url.s:
+            url.s.close()
+        return body
+
+    def request(_):
+        url = URL(url_str)
+        body = fetch(url)
+        return url, body
+
+    def parse(state):
+        url, body = state
+        return url, HTMLParser(body).parse()
+
+    def style_phase(state):
+        # stylesheet requests are part of this phase, like in a page load they need the parsed tree
+        url, rootnode = state
+        css_parser = CSSParser(default_css)
+        rules = css_parser.parse(origin_priority=1)
+        for node in tree_to_list(rootnode):
+            if isinstance(node, Element) and node.tag == "link" and node.attributes.get("rel") == "stylesheet" and "href" in node.attributes:
+                rules.extend(css_parser.parse(origin_priority=1, s=fetch(url.resolve(node.attributes["href"]))))
+        style(rootnode, rules, css_parser)
+        return rootnode, rules
+
+    def layout(state):
+        rootnode, rules = state
+        document = DocumentLayout(rootnode, None)
+        document.build()
+        document.layout(width=width)
+        return rootnode, rules, document
+
+    def paint(state):
+        rootnode, rules, document = state
+        display_list = []
+        paint_tree(document, display_list)
+        return rootnode, rules, document, display_list
+
+    return [("request", request), ("parse", parse), ("style", style_phase), ("layout", layout), ("paint", paint)]
+
+def run_once(phases, trace_memory=False) -> tuple[dict[str, float], tuple]:
+    """Seconds per phase, or with trace_memory the peak bytes allocated during each phase (slower)"""
+    results = {}
+    state = None
+    for name, fn in phases:
+        if trace_memory:
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            state = fn(state)
+            results[name] = tracemalloc.get_traced_memory()[1] - start
+        else:
+            start_time = time.perf_counter()
+            state = fn(state)
+            results[name] = time.perf_counter() - start_time
+    return results, state
+
+def bench_page(url_str: str, default_css: str, width: int, repeat: int, warmup: int) -> dict:
+    phases = pipeline(url_str, default_css, width)
+    for _ in range(warmup):
+        run_once(phases)
+    runs = [run_once(phases)[0] for _ in range(repeat)]
+
+    tracemalloc.start()
+    peaks, state = run_once(phases, trace_memory=True)
+    tracemalloc.stop()
+    rootnode, rules, document, display_list = state
+
+    result = {"nodes": sum(1 for _ in tree_to_list(rootnode)), "rules": len(rules), "display_list": len(display_list), "phases": {},
+              "memory": memory_report(rootnode, rules, document, display_list)}
+    for name in PHASES:
+        times = [run[name] for run in runs]
+        result["phases"][name] = {
+            "min": min(times),
+            "median": statistics.median(times),
+            "mean": statistics.fmean(times),
+            "peak_bytes": peaks[name],
+        }
+    result["total_median"] = sum(phase["median"] for phase in result["phases"].values())
+    return result
+
+def print_results(results: dict, baseline: dict | None = None):
+    for page, result in results["pages"].items():
+        print(f"\n{page}: {result['nodes']} nodes, {result['rules']} rules, {result['display_list']} display list entries")
+        for name in PHASES:
+            phase = result["phases"][name]
+            line = f"  {name:>8}: median{phase['median']*1000: 9.2f}ms  min{phase['min']*1000: 9.2f}ms  peak{phase['peak_bytes']/1024: 9.0f}KiB"
+            old = baseline and baseline["pages"].get(page, {}).get("phases", {}).get(name)
+            if old and old["median"]:
+                line += f"  x{phase['median'] / old['median']:.2f} vs baseline"
+            print(line)
+        # deep sizes of what the loaded page keeps alive
+        memory = result["memory"]
+        line = "  retained: " + ", ".join(f"{name} {entry['bytes']/1024:.0f}KiB" for name, entry in memory.items() if entry["count"])
+        old = baseline and baseline["pages"].get(page, {}).get("memory")
+        if old and old["total"]["bytes"]:
+            line += f"  x{memory['total']['bytes'] / old['total']['bytes']:.2f} vs baseline"
+        print(line)
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Per-phase page load benchmark over a synthetic corpus")
+    argparser.add_argument("--repeat", type=int, default=5, help="timed runs per page")
+    argparser.add_argument("--warmup", type=int, default=1, help="untimed runs per page before timing")
+    argparser.add_argument("--scale", type=int, default=1, help="corpus size multiplier")
+    argparser.add_argument("--width", type=int, default=1280, help="layout width")
+    argparser.add_argument("--pages", nargs="*", help="only these corpus pages, e.g. prose nested")
+    argparser.add_argument("--json", help="write results to this file")
+    argparser.add_argument("--compare", help="results file of an earlier run to compare medians against")
+    argparser.add_argument("--archive", help="also benchmark the html pages recorded in this fixture_server archive")
+    argparser.add_argument("--latency", type=float, default=0, help="server ms before each response")
+    argparser.add_argument("--bandwidth", type=float, default=0, help="server KiB/s, 0 for unlimited")
+    argparser.add_argument("--chunk", type=int, default=0, help="server sends chunked bodies with chunks of this many bytes")
+    args = argparser.parse_args()
+
+    # fonts need a Tk root to measure text, without a display use fixed metrics
+    try:
+        tkinter.Tk().withdraw()
+    except tkinter.TclError:
+        print("no display, measuring text with fixed metrics")
+        use_fixed_metrics()
+
+    corpus = make_corpus(args.scale)
+    routes = corpus_fixtures(corpus)
+    pages = {path[1:-5]: path for path in corpus if path.endswith(".html")}
+    if args.archive:
+        recorded = fixture_server.load(args.archive)
+        routes.update(fixture_server.by_path(recorded))
+        pages.update(recorded_pages(recorded))
+    server = fixture_server.serve(routes, latency_ms=args.latency, bandwidth_kbps=args.bandwidth, chunk_size=args.chunk)
+    default_css = open("browser.css").read()
+
+    results = {
+        "meta": {"repeat": args.repeat, "warmup": args.warmup, "scale": args.scale, "width": args.width, "time": time.time(),
+                 "latency": args.latency, "bandwidth": args.bandwidth, "chunk": args.chunk},
+        "pages": {},
+    }
+    for name, path in pages.items():
+        if args.pages and name not in args.pages:
+            continue
+        url_str = f"http://127.0.0.1:{server.server_port}{path}"
+        results["pages"][name] = bench_page(url_str, default_css, args.width, args.repeat, args.warmup)
+    server.shutdown()
+
+    baseline = json.load(open(args.compare)) if args.compare else None
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+        print("\nwrote", args.json)
@@ -0,0 +1,121 @@
+import cProfile
+import os
+import pstats
+import re
+import tracemalloc
+
+# -profile: one .pstats file per page load (Tab.load to the final layout) plus one for all frames
+# -memprofile: top allocating lines per load phase, and what grew since the previous load (leaks)
+# view .pstats with: python3 -m pstats profiles/<file>.pstats, or snakeviz
+
+PROFILE_DIR = "profiles"
+TOP_ALLOCATORS = 10 # lines shown per phase and per load diff
+
+cpu = False
+memory = False
+# python 3.12 allows one active profiler per process and it sees every thread, so loads and frames take turns:
+# frames that run while a load is profiled end up in the load's profile
+active = None
+frame_profile = None
+load_count = 0
+last_snapshot = None # tracemalloc snapshot at the end of the previous load
+
+def enable(cpu_profile=False, memory_profile=False):
+    global cpu, memory, frame_profile
+    cpu, memory = cpu_profile, memory_profile
+    if cpu:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        frame_profile = cProfile.Profile()
+    if memory:
+        tracemalloc.start()
+
+def start(profile: cProfile.Profile) -> bool:
+    global active
+    if active is not None:
+        return False
+    profile.enable()
+    active = profile
+    return True
+
+def stop(profile: cProfile.Profile):
+    global active
+    if active is profile:
+        profile.disable()
+        active = None
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    """Snapshot without the profilers' own allocations"""
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*"),
+    ])
+
+def print_top(title: str, stats: list[tracemalloc.StatisticDiff]):
+    print(f"  {title}:")
+    for stat in stats:
+        print(f"    {stat.size_diff / 1024:+9.1f} KiB {stat.count_diff:+7} blocks  {stat.traceback}")
+
+class LoadProfile:
+    """Profile of one page load. Phases are marked on the main thread, the first one
+    (fetch+style) covers the loader thread's work"""
+    def __init__(self, url):
+        global load_count
+        load_count += 1
+        self.number = load_count
+        self.url = url
+        self.phase_name = "fetch+style"
+        self.phases = [] # (name, top allocator diffs)
+        self.snapshot = take_snapshot() if memory else None
+        self.profile = cProfile.Profile() if cpu else None
+        if self.profile and not start(self.profile):
+            self.profile = None # an earlier load is still being profiled
+
+    def phase(self, name: str | None):
+        """The current phase ended and name starts"""
+        if memory:
+            snapshot = take_snapshot()
+            self.phases.append((self.phase_name, snapshot.compare_to(self.snapshot, "lineno")[:TOP_ALLOCATORS]))
+            self.snapshot = snapshot
+        self.phase_name = name
+
+    def cancel(self):
+        if self.profile:
+            stop(self.profile)
+
+    def finish(self):
+        global last_snapshot
+        self.phase(None)
+        if self.profile:
+            stop(self.profile)
+            slug = re.sub(r"[^A-Za-z0-9]+", "_", str(self.url).split("://", 1)[-1]).strip("_")[:60]
+            path = os.path.join(PROFILE_DIR, f"load{self.number:03d}_{slug}.pstats")
+            pstats.Stats(self.profile).dump_stats(path)
+            print("wrote", path)
+        if memory:
+            print(f"\nallocations of load {self.number} ({self.url}):")
+            for name, stats in self.phases:
+                print_top(name, stats)
+            if last_snapshot:
+                print_top(f"retained since load {self.number - 1}", self.snapshot.compare_to(last_snapshot, "lineno")[:TOP_ALLOCATORS])
+            last_snapshot = self.snapshot
+
+def start_load(url) -> LoadProfile | None:
+    if not (cpu or memory):
+        return None
+    return LoadProfile(url)
+
+def frame_start():
+    if cpu:
+        start(frame_profile)
+
+def frame_end():
+    if cpu:
+        stop(frame_profile)
+
+def finish():
+    """On exit: write the frame loop's profile"""
+    if cpu and frame_profile.getstats():
+        path = os.path.join(PROFILE_DIR, "frames.pstats")
+        pstats.Stats(frame_profile).dump_stats(path)
+        print("wrote", path)
@@ -1,11 +1,21 @@
+from bisect import bisect
 from dataclasses import dataclass
 import time
 import tkinter
-from css_parser import CSSParser, print_rules, style
-from html_parser import Element, HTMLParser, Text, print_tree
-from layout import MARGINS, AnonymousLayout, BlockLayout, DocumentLayout, Layout, TextFragment, TextLayout, paint_tree, print_layout_tree, print_paint, tree_to_fragment_list, tree_to_list
+from bfcache import BackForwardCache, CachedPage
+from css_parser import CSSParser, print_rules
+from draw import SpatialIndex
+from html_parser import Element, print_tree
+from loader import LoadResult, PageLoader, prefetch
+from memory import page_footprint, print_memory_report, tab_memory_report
+import profiling
+from tracing import span, traced
+from layout import MARGINS, BlockLayout, DocumentLayout, HitTestIndex, deferred_blocks, lazy_spine, paint_tree, print_layout_tree, print_paint, tree_to_fragment_list
 from url import URL
 
+LAZY_LOOKAHEAD = 1 # lazy layout: viewports laid out past the bottom of the window
+RETAIN_VIEWPORTS = 1 # canvas items further than this many viewports off-screen are deleted
+
 @dataclass
 class ScrollState:
     is_dragging: bool = False
@@ -20,7 +30,8 @@ class ScrollState:
     target_pos: int = 0
 
 class Tab:
-    def __init__(self, url: URL, canvas: tkinter.Canvas, tab_height, options: dict={}):
+    def __init__(self, url: URL, canvas: tkinter.Canvas, tab_height, options: dict={}, background=False):
+        """background: don't load until first shown (prefetching the page if the prefetch option is set)"""
         self.url = url
         self.canvas = canvas
         self.options = options
@@ -30,34 +41,103 @@ class Tab:
         self.tab_height = tab_height
         self.offset = 0
         self.dirty = True # render frame
+        self.full_redraw = True # drop retained canvas items on next frame
+        self.canvas_items = {} # display list index -> retained canvas item id
+        self.drawn_indices = [] # sorted keys of canvas_items, for stacking order
+        self.drawn_scroll = 0 # scroll position the retained items are placed at
+        self.items_created = 0 # canvas items created/deleted since the browser last read them, for frame metrics
+        self.items_deleted = 0
+        self.layout_until = 0 # lazy layout: y the document is laid out to
+        self.layout_width = None # canvas width of the last full layout, continuations need the same
+        self.pending_layout = None # after_idle() id of the next lazy layout pass
+        self.loader = None # PageLoader of the load in progress
+        self.load_profile = None # profiling.LoadProfile of the load in progress, with -profile/-memprofile
+        self.bfcache = BackForwardCache()
+        self.document_url = None # history entry the current document was loaded for
+        self.discarded = False # heavy state dropped to save memory or never loaded, (re)loaded when shown
+        self.prefetched = None # Future of a background tab's body, see loader.prefetch
+        self.restore_scroll = None # scroll position to restore once a reload of a discarded tab finishes
+        self.footprint = (None, 0) # (measured state, bytes), see memory_footprint
+        self.last_shown = 0 # time.monotonic() of the last time this tab was selected
         
         self.document = None
         self.display_list = []
+        # two indexes: clicks need the layout boxes, which the display list can't give back,
+        # merged DrawTexts cover several fragments and blocks without a background paint nothing
+        self.display_index = SpatialIndex([]) # display list entries by y, for culling
+        self.hit_index = None # line boxes and fragments by position, for clicks
         self.url = None
         self.history = [url]
         self.forward_history = []
         self.title = "blank"
         self._on_title_change = None
         self._on_open_in_new_tab = None
+        self._on_invalidate = None
+        self._on_load = None
         
         self.css_parser = CSSParser(open("browser.css").read())
         self.DEFAULT_STYLE_SHEET = self.css_parser.parse(origin_priority=1)
         self.rules = []
         
-        self.load(url)
+        if background:
+            self.url = url
+            self.discarded = True
+            if self.options.get("prefetch"):
+                self.prefetched = prefetch(url)
+        else:
+            self.load(url)
     
+    @traced("draw")
     def draw(self):
         self.update_scroll()
         if not self.dirty:
             return
         
-        self.canvas.delete("content")
-        for cmd in self.display_list:
-            if cmd.rect.top > self.scroll.pos + self.tab_height: continue
-            if cmd.rect.bottom + MARGINS[3] < self.scroll.pos: continue
-            cmd.execute(self.scroll.pos - self.offset, self.canvas, tags=('content'))
+        if self.full_redraw:
+            self.canvas.delete("content")
+            self.items_deleted += len(self.canvas_items)
+            self.canvas_items = {}
+            self.drawn_indices = []
+            self.drawn_scroll = self.scroll.pos
+            self.full_redraw = False
+        
+        # canvas items are retained between frames, scrolling just moves them
+        dy = self.drawn_scroll - self.scroll.pos
+        if dy:
+            self.canvas.move("content", 0, dy)
+            self.drawn_scroll = self.scroll.pos
+        
+        top, bottom = self.scroll.pos, self.scroll.pos + self.tab_height
+        keep = self.tab_height * RETAIN_VIEWPORTS
+        # far off-screen, free the item
+        for i in self.drawn_indices:
+            cmd = self.display_list[i]
+            if cmd.rect.top > bottom + keep or cmd.rect.bottom < top - keep:
+                self.canvas.delete(self.canvas_items.pop(i))
+                self.items_deleted += 1
+        if len(self.canvas_items) != len(self.drawn_indices):
+            self.drawn_indices = sorted(self.canvas_items)
+        
+        # only look at display list entries in the bands around the viewport
+        for i in self.display_index.query(top - MARGINS[3], bottom):
+            if i in self.canvas_items:
+                continue
+            cmd = self.display_list[i]
+            if cmd.rect.top > bottom: continue
+            if cmd.rect.bottom + MARGINS[3] < top: continue
+            self.create_item(i, cmd)
         
         self.dirty = False
+        
+    def create_item(self, i, cmd):
+        """Newly exposed display list entry, stacked below items that come after it in paint order"""
+        item = cmd.execute(self.scroll.pos - self.offset, self.canvas, tags=('content'))
+        j = bisect(self.drawn_indices, i)
+        if j < len(self.drawn_indices):
+            self.canvas.tag_lower(item, self.canvas_items[self.drawn_indices[j]])
+        self.drawn_indices.insert(j, i)
+        self.canvas_items[i] = item
+        self.items_created += 1
     
     def load(self, url: URL, fragment_scroll_animation=False):
         self.url = url
@@ -66,81 +146,275 @@ class Tab:
             self.jump_to_fragment(url.fragment, scroll_animation=fragment_scroll_animation)
             return
         
-        body = url.request()
-        self.rootnode = HTMLParser(body).parse()
-
-        # css rules
-        self.css_parser.reset()
-        self.rules = self.DEFAULT_STYLE_SHEET.copy()
-        tree_as_list = tree_to_list(self.rootnode)
-        for node in tree_as_list:
-            # external stylesheets
-            if isinstance(node, Element) and node.tag == "link" and node.attributes.get("rel") == "stylesheet" and "href" in node.attributes:
-                style_url = url.resolve(node.attributes['href'])
-                try:
-                    body = style_url.request()
-                    self.rules.extend(self.css_parser.parse(origin_priority=1, s=body))
-                except:
-                    print("Could not fetch stylesheet from", style_url)
-
-            elif isinstance(node, Text) and node.parent.tag == "title":
-                self.title = node.text
-                if self._on_title_change:
-                    self._on_title_change(self.title)
-
-        start_time = time.perf_counter()
-        style(self.rootnode, self.rules, self.css_parser)
-        elapsed_time = time.perf_counter() - start_time
+        self.save_to_bfcache()
+        self.stop_loading()
+        self.layout_until = 0
+        
+        # fetch, parse and style off the main thread, finish_load picks it up from there
+        self.load_profile = profiling.start_load(url)
+        self.loader = PageLoader(url, self.DEFAULT_STYLE_SHEET, self.canvas, self.finish_load,
+                                 progressive=self.options.get("progressive", False), prefetched=self.prefetched)
+        self.prefetched = None
+        self.loader.start()
         
+    def stop_loading(self):
+        if self.pending_layout:
+            self.canvas.after_cancel(self.pending_layout)
+            self.pending_layout = None
+        if self.loader:
+            self.loader.cancel()
+            self.loader = None
+        if self.load_profile:
+            self.load_profile.cancel()
+            self.load_profile = None
+            
+    def cancel_prefetch(self):
+        if self.prefetched:
+            self.prefetched.cancel() # only if it hasn't started, the other tabs' prefetches queue behind it
+            self.prefetched = None
+            
+    def close(self):
+        self.stop_loading()
+        self.cancel_prefetch()
+        
+    def finish_load(self, result: LoadResult):
+        """Lay out and show a load result. Partial results (-progressive) are replaced by later ones"""
+        if not result.partial:
+            self.loader = None
+        url = result.url
+        profile = None
+        if not result.partial:
+            profile, self.load_profile = self.load_profile, None
+        if result.error:
+            print("Could not load", url, result.error)
+            if profile:
+                profile.cancel()
+            return
+        
+        self.document_url = url
+        self.rootnode = result.rootnode
+        self.rules = result.rules
+        if result.title is not None:
+            self.title = result.title
+            if self._on_title_change:
+                self._on_title_change(self.title)
+        elapsed_time = result.style_time
+        
+        if profile:
+            profile.phase("build")
         self.document = DocumentLayout(self.rootnode, self.canvas)
+        with span("build"):
+            self.document.build()
         # conditional debug output controlled by CLI flags:
         if self.options.get("t", False): print(print_tree(self.rootnode, source=True))
         if self.options.get("c", False): print_rules(self.rules); print(f"style() in{elapsed_time: .6f} seconds, {len(self.rules)} rules")
         
         print("\nCalculating layout...\n")
-        self._layout()
+        restoring = self.restore_scroll is not None
+        if result.first:
+            self.scroll.pos = self.scroll.target_pos = self.restore_scroll or 0
+        if not result.partial:
+            self.restore_scroll = None
+        # the fragment target may be anywhere in the page, so lay out all of it
+        jump = bool(url.fragment) and not result.partial and not restoring
+        if profile:
+            profile.phase("layout")
+        self.layout_until = 0 # every result is a new document
+        self._layout(full=jump, bounded=result.partial)
+        if profile:
+            profile.finish()
+        if self.options.get("mem", False) and not result.partial:
+            print_memory_report(tab_memory_report(self), f"memory of {url}:")
 
         # jump to fragment if present
-        if url.fragment:
+        if jump:
             self.jump_to_fragment(url.fragment, scroll_animation=False)
-        else:
-            self.scroll.pos = self.scroll.target_pos = 0
+        if not result.partial and self._on_load:
+            self._on_load(self)
 
-    def _layout(self):
+    def _layout(self, full=False, bounded=False):
+        """In lazy mode (-lazy) only lay out down to the viewport plus a lookahead,
+        the rest is continued in idle time or when scrolled into.
+        bounded: the same for one pass without -lazy, for partial results of a progressive load"""
+        if not self.document: # still loading
+            return
         start_time = time.perf_counter()
-        self.document.layout()
-        self.display_list = []
-        paint_tree(self.document, self.display_list)
+        until = None
+        if (self.options.get("lazy") or bounded) and not full:
+            until = self._lazy_until()
+        self.layout_width = self.canvas.winfo_width()
+        with span("layout", until=until):
+            self.document.layout(until=until)
+        with span("paint"):
+            self.display_list = []
+            fragment_count = paint_tree(self.document, self.display_list)
+            self.display_index = SpatialIndex(self.display_list)
+            self.hit_index = HitTestIndex(self.document)
         #print_layout_tree(self.document)
         #print_paint(self.display_list)
+        self._layout_done(start_time, fragment_count)
+        self.invalidate(full=True)
+        
+    def _lazy_until(self) -> float:
+        self.layout_until = max(self.layout_until, self.scroll.target_pos + self.tab_height * (1 + LAZY_LOOKAHEAD))
+        return self.layout_until
+    
+    def _extend_layout(self):
+        """Lazy layout further down the page. Only the newly laid out part is painted and
+        indexed, the items already on the canvas stay"""
+        if self.canvas.winfo_width() != self.layout_width: # resize pending
+            return self._layout()
+        start_time = time.perf_counter()
+        spine = lazy_spine(self.document)
+        until = self._lazy_until()
+        with span("layout", until=until):
+            self.document.layout(until=until)
+        with span("paint"):
+            start = len(self.display_list)
+            roots = deferred_blocks(spine)
+            fragment_count = 0
+            for root in roots:
+                fragment_count += paint_tree(root, self.display_list)
+            for i in range(start, len(self.display_list)):
+                self.display_index.add(i)
+            # backgrounds of the blocks that were cut off now cover their new height
+            grown = [block for block, _ in spine if isinstance(block, BlockLayout)]
+            for block in grown:
+                if block.background:
+                    block.background.rect = block.self_rect()
+                    i = self.display_list.index(block.background)
+                    self.display_index.add(i)
+                    if i in self.canvas_items:
+                        self.canvas.delete(self.canvas_items.pop(i))
+                        self.drawn_indices.remove(i)
+                        self.items_deleted += 1
+            self.hit_index.extend(roots, grown)
+        self._layout_done(start_time, fragment_count)
+        self.invalidate()
+        
+    def _layout_done(self, start_time, fragment_count):
         elapsed_time = time.perf_counter() - start_time
-        print(f"layout() {self.canvas.winfo_width()}x{self.canvas.winfo_height()} in{elapsed_time: .6f} seconds, {len(self.display_list)} nodes")
+        print(f"layout() {self.canvas.winfo_width()}x{self.canvas.winfo_height()} in{elapsed_time: .6f} seconds, {len(self.display_list)} nodes from {fragment_count} fragments")
         self.text_height = max(self.document.height, 0)
-        self.invalidate() 
+        # a partial result of a load is replaced by the next one, it's only continued when scrolled into
+        if self.document.partial and not self.pending_layout and not self.loader:
+            self.pending_layout = self.canvas.after_idle(self._continue_layout)
+            
+    def _continue_layout(self):
+        """Lazy layout idle step, doubles the laid out range each time"""
+        self.pending_layout = None
+        if self.document and self.document.partial:
+            self.layout_until *= 2
+            self._extend_layout()
+        
+    def memory_footprint(self) -> int:
+        """Approximate bytes held by this tab's page and its back/forward cache"""
+        return self.page_size() + self.bfcache.size
+    
+    def page_size(self, remeasure=True) -> int:
+        """Approximate bytes held by the current page. Remeasured only when the document or display list changed,
+        or with remeasure=False only for a new document (lazy layout may have grown the display list since)"""
+        state = (self.document, len(self.display_list))
+        measured = self.footprint[0]
+        if measured != state and (remeasure or measured is None or measured[0] is not self.document):
+            self.footprint = (state, page_footprint(self.rootnode, self.document, self.display_list))
+        return self.footprint[1]
+    
+    def discard(self):
+        """Drop everything but the URL, title, history and scroll position"""
+        self.stop_loading()
+        self.cancel_prefetch()
+        self.rootnode = []
+        self.rules = []
+        self.document = None
+        self.display_list = []
+        self.display_index = SpatialIndex([])
+        self.hit_index = None
+        self.canvas_items = {}
+        self.drawn_indices = []
+        self.footprint = (None, 0)
+        self.bfcache = BackForwardCache()
+        self.discarded = True
+    
+    def reload_discarded(self):
+        self.discarded = False
+        self.restore_scroll = self.scroll.target_pos
+        url = self.url
+        if hasattr(url, "fragment_no_load_required") and self.document_url:
+            # a fragment link only scrolled, the document came from an earlier entry
+            self.load(self.document_url)
+            self.url = url
+        else:
+            self.load(url)
         
     def navigate(self, url_str: str, from_user_input: bool = False):
         url_obj = self.url.resolve(url_str, from_user_input=from_user_input)
         self.history.append(url_obj)
         self.forward_history = []
+        self.bfcache.retain(self.history)
         self.load(url_obj, fragment_scroll_animation=True)
     
     def go_back(self):
         if self.can_go_back():
             self.forward_history.append(self.history.pop())
             back = self.history[-1]
-            self.load(back) # TODO: call resolve on back nav, so we get url.fragment_no_render_required 
+            if not self.restore_from_bfcache(back):
+                self.load(back) # TODO: call resolve on back nav, so we get url.fragment_no_render_required 
             
     def go_forward(self):
         if self.can_go_forward():
             forward = self.forward_history.pop()
             self.history.append(forward)
-            self.load(forward)
+            if not self.restore_from_bfcache(forward):
+                self.load(forward)
+                
+    def save_to_bfcache(self):
+        """Keep the fully loaded current page around for back/forward"""
+        if not self.document or not self.document_url or self.loader:
+            return
+        self.bfcache.put(CachedPage(
+            self.document_url, self.rootnode, self.rules, self.document,
+            self.display_list, self.display_index, self.hit_index,
+            self.text_height, self.title, self.scroll.target_pos, self.canvas.winfo_width(),
+            # walking the page takes ~100ms on big ones, the measurement from tab_loaded is good enough
+            self.page_size(remeasure=False)))
+    
+    def restore_from_bfcache(self, url: URL) -> bool:
+        page = self.bfcache.pop(url)
+        if not page:
+            return False
+        self.save_to_bfcache()
+        self.stop_loading()
+        
+        self.url = self.document_url = url
+        self.rootnode, self.rules, self.document = page.rootnode, page.rules, page.document
+        self.display_list, self.display_index, self.hit_index = page.display_list, page.display_index, page.hit_index
+        self.text_height = page.text_height
+        self.footprint = ((self.document, len(self.display_list)), page.size)
+        self.layout_until = 0 # the previous page's lazy layout bound
+        self.scroll.pos = self.scroll.target_pos = page.scroll_pos
+        self.scroll.velocity = 0
+        self.title = page.title
+        if self._on_title_change:
+            self._on_title_change(self.title)
+        
+        # window was resized since, or lazy layout hadn't finished: relayout reuses the cached line boxes
+        if page.width != self.canvas.winfo_width() or self.document.partial:
+            self._layout()
+        else:
+            self.invalidate(full=True)
+        return True
         
     def can_go_back(self): return len(self.history) > 1
 
     def can_go_forward(self): return self.forward_history
     
     def jump_to_fragment(self, target_fragment: str, scroll_animation=True):
+        if not self.document:
+            return
+        # lazy layout: the target may be in the part that isn't laid out yet
+        if self.document.partial:
+            self._layout(full=True)
         # scan layout tree for fragment with a parent layout that contains the node with fragment in id attribute
         for fragment in tree_to_fragment_list(self.document):
             layout = fragment.parent_layout
@@ -161,15 +435,18 @@ class Tab:
         """Down arrow / Linux mouse wheel down"""
         self.scroll.velocity += 4
         self.scroll.target_pos += self.scroll.step
+        self.invalidate()
     
     def scrollup(self):
         """Up arrow / Linux mouse wheel up"""
         self.scroll.velocity -= 4
         self.scroll.target_pos -= self.scroll.step
+        self.invalidate()
         
     def scrolldelta(self, delta):
         """Windows / macOS scroll"""
         self.scroll.velocity += self.scroll.step / 2 * delta
+        self.invalidate()
         
     def update_scroll(self):
         height = self.tab_height
@@ -182,6 +459,8 @@ class Tab:
         # and still need to render as long as velocity is nonzero
         if abs(self.scroll.velocity) < 0.1 and abs(self.scroll.target_pos - self.scroll.pos) < 0.5:
             self.scroll.velocity = 0
+            if self.scroll.pos != self.scroll.target_pos:
+                self.invalidate() # retained items still sit at the unsnapped position
             self.scroll.pos = self.scroll.target_pos
         else:
             self.invalidate()
@@ -191,6 +470,11 @@ class Tab:
         self.scroll.pos = max(0, self.scroll.pos)
         self.scroll.target_pos = min(self.scroll.target_pos, self.text_height-height+MARGINS[3])
         self.scroll.target_pos = max(0, self.scroll.target_pos)
+        
+        # lazy layout: scrolled past the laid out range
+        if self.document and self.document.partial and \
+                self.scroll.target_pos + self.tab_height * (1 + LAZY_LOOKAHEAD) > self.layout_until:
+            self._extend_layout()
 
     def on_leftmouse_down(self, x, y):
         width = self.canvas.winfo_width()
@@ -203,7 +487,8 @@ class Tab:
 
         # calculate x, y RELATIVE to scroll
         y += self.scroll.pos
-        elt = self.get_layout_at_coords(x, y).node
+        layout = self.get_layout_at_coords(x, y)
+        elt = layout.node if layout else None
         while elt:
             if isinstance(elt, Element) and elt.tag == "a" and "href" in elt.attributes:
                 print("Clicked: ", elt.attributes["href"])
@@ -212,7 +497,8 @@ class Tab:
             
     def on_middlemouse_down(self, x, y):
         y += self.scroll.pos
-        elt = self.get_layout_at_coords(x, y).node
+        layout = self.get_layout_at_coords(x, y)
+        elt = layout.node if layout else None
         while elt:
             if isinstance(elt, Element) and elt.tag == "a" and "href" in elt.attributes:
                 print("Open in new tab:", elt.attributes["href"])
@@ -234,39 +520,21 @@ class Tab:
         else:
             screen_percent = y / self.tab_height
             self.scroll.target_pos = self.scroll.pos = (self.text_height - self.tab_height) * screen_percent
-            self.invalidate()
+        self.invalidate()
 
     def on_mouse_up(self):
         self.scroll.is_dragging = False
         
-    def invalidate(self):
+    def invalidate(self, full=False):
+        """Request a frame. full drops retained canvas items, needed when the display list
+        changed or another tab drew on the canvas"""
         self.dirty = True
+        if full:
+            self.full_redraw = True
+        if self._on_invalidate:
+            self._on_invalidate(self)
         
     def get_layout_at_coords(self, x, y):
-        objs = []
-
-        for obj in tree_to_list(self.document):
-            if not isinstance(obj, (BlockLayout, AnonymousLayout)):
-                continue
-            
-            # layer 1: clicked on a block layout
-            if obj.x <= x < obj.x + obj.width and obj.y <= y < obj.y + obj.height:
-                objs.append(obj)
-            
-            # layer 2: clicked on a textfragment within a block layout's line boxes
-            frag = self.hit_test_block(obj, x, y)
-            if frag:
-                objs.append(frag.parent_layout)
-        
-        if not objs: return
-        return objs[-1] # most recently painted object is probably the one clicked on
-    
-    def hit_test_block(self, block: Layout, x, y) -> TextFragment | None:
-        for line in block.line_boxes:
-            if y < line.y or y >= line.y + line.height:
-                continue
-            for fragment in line.children:
-                fx, fy, fw, fh = fragment.x, line.y, fragment.width, line.height
-                if fx <= x < fx+fw and fy <= y < fy+fh:
-                    return fragment
-        return None
\ No newline at end of file
+        if not self.hit_index: # still loading
+            return None
+        return self.hit_index.layout_at(x, y)
@@ -0,0 +1,69 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+# nested timing spans for a page load and frames, written as Chrome trace-event JSON
+# (open in chrome://tracing or https://ui.perfetto.dev). Off unless enable() is called,
+# then span() costs a global lookup and returns a shared no-op context manager
+
+enabled = False
+events = []
+thread_names = {} # tid -> thread name, for the viewer's track labels
+NO_SPAN = contextlib.nullcontext()
+
+def enable():
+    global enabled
+    enabled = True
+
+def now_us() -> float:
+    return time.perf_counter_ns() / 1000
+
+class Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = now_us()
+        return self
+
+    def __exit__(self, *exc):
+        end = now_us()
+        thread = threading.current_thread()
+        thread_names[thread.ident] = thread.name
+        # list.append is atomic, worker threads can record spans too
+        events.append({"name": self.name, "ph": "X", "ts": self.start, "dur": end - self.start,
+                       "pid": os.getpid(), "tid": thread.ident, "args": self.args})
+        return False
+
+def span(name: str, **args):
+    """with span("layout"): ... records how long the block took, nested spans show up stacked"""
+    if not enabled:
+        return NO_SPAN
+    return Span(name, args)
+
+def traced(name: str):
+    """Decorator version of span for whole methods"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with Span(name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def dump(path: str):
+    pid = os.getpid()
+    metadata = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "browser"}}]
+    metadata += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                 for tid, name in thread_names.items()]
+    with open(path, "w") as file:
+        json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, file)
+    print(f"wrote {len(events)} trace events to {path}")
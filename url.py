@@ -1,6 +1,30 @@
+import copy
 import socket
 import ssl
-import gzip
+import zlib
+
+# optional decompressors, advertised in Accept-Encoding only when importable
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+try:
+    from compression import zstd # python 3.14+
+    _ZSTD_STDLIB = True
+except ImportError:
+    _ZSTD_STDLIB = False
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+ACCEPT_ENCODING = ", ".join((["br"] if brotli else []) + (["zstd"] if zstd else []) + ["gzip", "deflate"])
+
+READ_SIZE = 16384 # bytes read at a time when reporting body progress
+BUFFER_SIZE = 65536 # receive buffer of a connection, reused for every response on it
 
 def is_url(url: str):
     if " " in url:
@@ -10,10 +34,141 @@ def is_url(url: str):
     if "://" in url and all(url.split("://")):
         return True
 
+class ResponseReader:
+    """Reads responses from a socket through one receive buffer that lives as long as the connection.
+    Body data is handed out as memoryviews into that buffer (valid until the next read) or received
+    straight into the caller's buffer, so it isn't copied on the way"""
+    def __init__(self, sock, size=BUFFER_SIZE):
+        self.sock = sock
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = self.end = 0 # unread data is buffer[start:end]
+        
+    def fill(self):
+        """Receive more data after the unread part, moving it to the front of the buffer if needed"""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            if self.start == 0: # a single line longer than the buffer
+                self.view.release()
+                self.buffer.extend(bytes(len(self.buffer)))
+                self.view = memoryview(self.buffer)
+            else:
+                unread = self.end - self.start
+                self.view[:unread] = self.view[self.start:self.end]
+                self.start, self.end = 0, unread
+        received = self.sock.recv_into(self.view[self.end:])
+        if not received:
+            raise ConnectionError("connection closed in the middle of a response")
+        self.end += received
+        
+    def readline(self) -> bytes:
+        """Status, header and chunk size lines, including the line ending"""
+        while True:
+            i = self.buffer.find(b"\n", self.start, self.end)
+            if i >= 0:
+                line = bytes(self.view[self.start:i+1])
+                self.start = i + 1
+                return line
+            self.fill()
+            
+    def read(self, length):
+        """Yields memoryviews of the next length bytes"""
+        while length > 0:
+            if self.start == self.end:
+                self.fill()
+            n = min(length, self.end - self.start)
+            piece = self.view[self.start:self.start+n]
+            self.start += n
+            length -= n
+            yield piece
+            
+    def read_into(self, target: memoryview):
+        """Fill target, with what's buffered first and then straight from the socket"""
+        n = min(len(target), self.end - self.start)
+        target[:n] = self.view[self.start:self.start+n]
+        self.start += n
+        while n < len(target):
+            received = self.sock.recv_into(target[n:])
+            if not received:
+                raise ConnectionError("connection closed in the middle of a response")
+            n += received
+
+class DeflateStage:
+    """Content-Encoding: deflate is meant to be zlib wrapped, some servers send raw deflate"""
+    def __init__(self):
+        self.head = b""
+        self.decompressor = None
+        
+    def decompress(self, data) -> bytes:
+        if self.decompressor is None:
+            # tell the two apart by the zlib header: compression method 8 and a checksum divisible by 31
+            self.head += bytes(data)
+            if len(self.head) < 2:
+                return b""
+            zlib_wrapped = self.head[0] & 0x0f == 8 and (self.head[0] << 8 | self.head[1]) % 31 == 0
+            self.decompressor = zlib.decompressobj(wbits=15 if zlib_wrapped else -15)
+            data, self.head = self.head, b""
+        return self.decompressor.decompress(data)
+    
+    def flush(self) -> bytes:
+        return self.decompressor.flush() if self.decompressor else b""
+
+class StreamStage:
+    """decompress/flush interface over decompressors that only have a one-way feed method.
+    Some of them (brotlicffi) don't take buffers, so the receive buffer views are copied"""
+    def __init__(self, feed):
+        self.feed = feed
+        
+    def decompress(self, data) -> bytes:
+        return self.feed(bytes(data))
+        
+    def flush(self) -> bytes:
+        return b""
+
+def make_stage(encoding: str):
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(wbits=31)
+    if encoding == "deflate":
+        return DeflateStage()
+    if encoding == "br" and brotli:
+        decompressor = brotli.Decompressor()
+        # brotli calls it process, brotlicffi has both
+        return StreamStage(getattr(decompressor, "process", None) or decompressor.decompress)
+    if encoding == "zstd" and zstd:
+        if _ZSTD_STDLIB:
+            return StreamStage(zstd.ZstdDecompressor().decompress)
+        return zstd.ZstdDecompressor().decompressobj()
+    raise ValueError(f"unsupported content-encoding: {encoding}")
+
+class ContentDecoder:
+    """Streaming decompression of a Content-Encoding, fed as the body arrives so the
+    compressed body is never held in full. Several encodings are undone in reverse order"""
+    def __init__(self, encodings: list[str]):
+        self.stages = [make_stage(encoding) for encoding in reversed(encodings)]
+        
+    def decompress(self, data) -> bytes:
+        for stage in self.stages:
+            data = stage.decompress(data)
+        return data
+    
+    def flush(self) -> bytes:
+        data = b""
+        for stage in self.stages:
+            data = (stage.decompress(data) if data else b"") + stage.flush()
+        return data
+
+def make_decoder(content_encoding: str | None) -> ContentDecoder | None:
+    """Decoder for a Content-Encoding header, None if the body isn't encoded"""
+    encodings = [encoding.strip().lower() for encoding in (content_encoding or "").split(",")]
+    encodings = [encoding for encoding in encodings if encoding not in ("", "identity")]
+    return ContentDecoder(encodings) if encodings else None
+
 class URL:
     def __init__(self, url: str):
         self.redirects = 0
         self.s = None # socket placeholder
+        self.reader = None # ResponseReader of self.s
         self._init_state(url)
     
     def __str__(self):
@@ -32,6 +187,19 @@ class URL:
         
     def __repr__(self): return self.__str__()
     
+    def copy(self) -> "URL":
+        """Same URL without the connection, for a request that must not share this one's socket"""
+        url = copy.copy(self)
+        url.s = None
+        url.reader = None
+        return url
+    
+    def follow(self, other: "URL"):
+        """Take over where a copy ended up after redirects, keeping this object's connection"""
+        for name, value in vars(other).items():
+            if name not in ("s", "reader"):
+                setattr(self, name, value)
+    
     def _init_state(self, url: str) -> None:
         self.url_str = url
         """Extracts parts of URL
@@ -98,14 +266,17 @@ class URL:
                 print("closed")
                 self.s.close()
                 self.s = None
+                self.reader = None
         except Exception:
             print("URL scheme error!")
             self._init_state("about:blank")
 
-    def request(self, headers: dict={}) -> str:
+    def request(self, headers: dict={}, on_body=None) -> str:
         print("request:", self.url_str)
         """Performs a **GET** request using HTTP/1.1 connection: keep-alive
-        \n Automatically performs up to 100 redirects"""
+        \n Automatically performs up to 100 redirects
+        \n Accepts the content encodings in ACCEPT_ENCODING unless headers has its own Accept-Encoding
+        \n on_body(content) is called with the (decompressed) body bytes received so far as they arrive"""
         if self.scheme == "blank":
             return ""
         
@@ -137,56 +308,82 @@ class URL:
                 self.s = ctx.wrap_socket(self.s, server_hostname=self.host)
                 
             self.s.connect((self.host, self.port))
+            self.reader = ResponseReader(self.s)
 
         request =  f"GET {self.path} HTTP/1.1\r\n"
         request += f"Host: {self.host}\r\n"
         request += f"Connection: keep-alive\r\n"
+        if not any(header.lower() == "accept-encoding" for header in headers):
+            request += f"Accept-Encoding: {ACCEPT_ENCODING}\r\n"
         for header, value in headers.items():
             request += f"{header}: {value}\r\n"
         request += "\r\n"
 
         self.s.send(request.encode("utf8"))
-        response = self.s.makefile("rb", encoding="utf8", newline="\r\n")
-        statusline = response.readline().decode("utf-8")
-        print("Statusline:", statusline.strip())
-        version, status, explanation = statusline.split(" ", 2)
+        response = self.reader
+        statusline = response.readline()
+        print("Statusline:", statusline.strip().decode("latin-1"))
+        version, status, explanation = statusline.split(b" ", 2)
         
+        # headers are parsed as bytes, only names and values are decoded
         response_headers = {}
         while True:
-            line = response.readline().decode("utf-8")
-            if line == "\r\n": 
+            line = response.readline()
+            if line in (b"\r\n", b"\n"): 
                 break
-            header, value = line.split(":", 1)
-            response_headers[header.casefold()] = value.strip()
+            header, value = line.split(b":", 1)
+            response_headers[header.decode("latin-1").casefold()] = value.strip().decode("latin-1")
         
-        # handle redirects
-        if status.startswith('3') and "location" in response_headers:
-            content = self._redirect(response_headers["location"])
-            self.redirects = 0
-            return content
+        # redirect bodies are read (the connection is reused) but not shown
+        redirect = status.startswith(b'3') and "location" in response_headers
+        redirect_on_body = on_body
+        if redirect:
+            on_body = None
         
-        # unchunk the data
+        # body pieces are views into the receive buffer, decompressed straight from there
+        decoder = make_decoder(response_headers.get("content-encoding"))
         content = bytearray()
+        def consume(piece: memoryview):
+            content.extend(decoder.decompress(piece) if decoder else piece)
+        
+        # unchunk the data
         if response_headers.get("transfer-encoding") == "chunked":
             while True:
-                chunk_size = int(response.readline().decode("utf-8").strip(), 16)
+                chunk_size = int(response.readline().split(b";")[0], 16)
                 if chunk_size == 0:
+                    response.readline() # blank line ending the chunked body
                     break
-                chunk = response.read(chunk_size)
-                content.extend(chunk)
-                response.read(2)
+                for piece in response.read(chunk_size):
+                    consume(piece)
+                response.readline() # line ending after the chunk
+                if on_body: on_body(content)
         
         # content-length cannot appear if chunked
         elif "content-length" in response_headers:
-            content = response.read(int(response_headers["content-length"]))
-            
-        # decompress and decode 
-        if response_headers.get("content-encoding") == "gzip":
-            content = gzip.decompress(content)
+            length = int(response_headers["content-length"])
+            if decoder or on_body:
+                received = 0
+                while received < length:
+                    for piece in response.read(min(READ_SIZE, length - received)):
+                        consume(piece)
+                        received += len(piece)
+                    if on_body: on_body(content)
+            else:
+                # plain body: received straight into its final buffer
+                content = bytearray(length)
+                response.read_into(memoryview(content))
+        if decoder:
+            content.extend(decoder.flush())
+        
+        # handle redirects
+        if redirect:
+            content = self._redirect(response_headers["location"], redirect_on_body)
+            self.redirects = 0
+            return content
             
         return content.decode("utf-8")
                 
-    def _redirect(self, location: str) -> str:
+    def _redirect(self, location: str, on_body=None) -> str:
         print("Redirecting to", location)
         if self.redirects >= 100:
             return "Error: Redirect Limit Reached"
@@ -197,7 +394,7 @@ class URL:
             self._init_state(location)
         
         self.redirects += 1
-        return self.request()
+        return self.request(on_body=on_body)
 
     def resolve(self, url: str, from_user_input: bool = False):
         if url.startswith("#"): # fragment link, return URL with no_load_required flag
@@ -264,7 +461,7 @@ def show(body: str) -> None: # print all text between tags
 def load(url: URL) -> None:
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-        "Accept-Encoding": "gzip"
+        "Accept-Encoding": ACCEPT_ENCODING
     }
     if url.source:
         print(url.request(headers))